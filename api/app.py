@@ -1,28 +1,24 @@
 # app.py
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
+from quart import Quart, Response, request, jsonify, send_from_directory
+from quart_cors import cors
 from functools import wraps
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 import asyncio
+import json
 from dotenv import load_dotenv
 import os
 
 from email_analyzer import EmailAnalyzer
+import metrics
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__, static_url_path='', static_folder='static')
-CORS(app)
+app = Quart(__name__, static_url_path='', static_folder='static')
+app = cors(app)
 email_analyzer = None
-
-# Utility decorator to handle async routes
-def async_route(f):
-    @wraps(f)
-    def wrapped(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
-    return wrapped
+analyzer_lock = None
 
 # Error handler for generic exceptions
 @app.errorhandler(Exception)
@@ -32,59 +28,120 @@ def handle_error(error):
         "status": "error"
     }), 500
 
-def get_analyzer():
+async def get_analyzer():
     """
     Get or initialize the analyzer
     """
-    global email_analyzer
-    if email_analyzer is None:
-        try:
-            email_analyzer = EmailAnalyzer()
-            asyncio.run(email_analyzer.setup_vector_store())
-        except Exception as e:
-            app.logger.error(f"Failed to initialize analyzer: {str(e)}")
-            raise
+    global email_analyzer, analyzer_lock
+    if email_analyzer is not None:
+        return email_analyzer
+
+    # The lock is created lazily so it is bound to the server's event loop
+    if analyzer_lock is None:
+        analyzer_lock = asyncio.Lock()
+
+    async with analyzer_lock:
+        if email_analyzer is None:
+            analyzer = EmailAnalyzer()
+            try:
+                await analyzer.setup_vector_store()
+            except Exception as e:
+                app.logger.error(f"Failed to initialize analyzer: {str(e)}")
+                await analyzer.aclose()
+                raise
+            email_analyzer = analyzer
     return email_analyzer
 
+@app.after_serving
+async def shutdown():
+    """
+    Release the analyzer's shared HTTP connections
+    """
+    if email_analyzer is not None:
+        await email_analyzer.aclose()
+
 # Middleware to check if analyzer is initialized
 def require_analyzer():
     def decorator(f):
         @wraps(f)
-        def wrapped(*args, **kwargs):
+        async def wrapped(*args, **kwargs):
             try:
-                analyzer = get_analyzer()
-                return f(*args, **kwargs)
+                await get_analyzer()
             except Exception as e:
                 return jsonify({
                     "error": "Service initialization failed: " + str(e),
                     "status": "error"
                 }), 503
+            return await f(*args, **kwargs)
         return wrapped
     return decorator
 
 # Routes
 @app.route('/')
-def index():
-    return app.send_static_file('index.html')
+async def index():
+    return await app.send_static_file('index.html')
 
 #health
 @app.route('/health')
-def health():
+async def health():
     return jsonify({'status': 'ok'})
 
+@app.route('/metrics')
+async def get_metrics():
+    """
+    Prometheus metrics: per-stage search and indexing latencies, cache hits
+    """
+    data, content_type = metrics.export()
+    return Response(data, content_type=content_type)
+
 @app.route('/<path:path>')
-def send_static(path):
-    return send_from_directory('static', path)
+async def send_static(path):
+    return await send_from_directory('static', path)
+
+def serialize_email(email):
+    """
+    Convert a retrieved document to the API's email representation
+    """
+    return {
+        "sender": email.metadata["sender"],
+        "subject": email.metadata["subject"],
+        "date": email.metadata["date"],
+        "body": email.page_content,
+        "email_id": email.metadata["email_id"]
+    }
+
+def parse_search_filters(data):
+    """
+    Read the optional sender / date_from / date_to filters of a search request
+    """
+    filters = {}
+    if data.get('sender'):
+        filters['sender'] = str(data['sender'])
+    for field in ('date_from', 'date_to'):
+        if data.get(field):
+            try:
+                filters[field] = datetime.fromisoformat(str(data[field]))
+            except ValueError:
+                raise ValueError(f"Invalid date for '{field}', expected ISO 8601")
+            # A bare end date includes the whole day
+            if field == 'date_to' and len(str(data[field])) == 10:
+                filters[field] += timedelta(days=1, microseconds=-1)
+    return filters
+
+def sse_event(event, data):
+    """
+    Format a server-sent event with a JSON payload
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @app.route('/api/v1/search', methods=['POST'])
 @require_analyzer()
-@async_route
 async def search_emails():
     """
     Search emails using natural language query
     """
     try:
-        data = request.get_json()
+        data = await request.get_json()
         if not data or 'question' not in data:
             return jsonify({
                 "error": "Missing required field 'question'",
@@ -93,23 +150,28 @@ async def search_emails():
 
         question = data['question']
         limit = data.get('limit', 3)
+        try:
+            filters = parse_search_filters(data)
+        except ValueError as e:
+            return jsonify({
+                "error": str(e),
+                "status": "error"
+            }), 400
 
-        answer, relevant_emails = await email_analyzer.search_with_context(question, limit, score_threshold=0.5)
+        # Opt-in breakdown of the time spent in each stage of this search
+        trace = metrics.start_trace() if data.get('trace') else None
+        with metrics.SEARCH_SECONDS.labels('search').time():
+            answer, relevant_emails = await email_analyzer.search_with_context(
+                question, limit, score_threshold=0.5, filters=filters
+            )
         
         response = {
             "status": "success",
             "answer": answer,
-            "relevant_emails": [
-                {
-                    "sender": email.metadata["sender"],
-                    "subject": email.metadata["subject"],
-                    "date": email.metadata["date"],
-                    "body": email.page_content,
-                    "email_id": email.metadata["email_id"]
-                }
-                for email in relevant_emails
-            ]
+            "relevant_emails": [serialize_email(email) for email in relevant_emails]
         }
+        if trace is not None:
+            response["trace"] = trace.as_dict()
         
         return jsonify(response)
 
@@ -119,16 +181,67 @@ async def search_emails():
             "status": "error"
         }), 500
 
+@app.route('/api/v1/search/stream', methods=['POST'])
+@require_analyzer()
+async def search_emails_stream():
+    """
+    Search emails and stream the answer as server-sent events:
+    the relevant emails first, then the answer tokens as they are generated
+    """
+    data = await request.get_json()
+    if not data or 'question' not in data:
+        return jsonify({
+            "error": "Missing required field 'question'",
+            "status": "error"
+        }), 400
+
+    question = data['question']
+    limit = data.get('limit', 3)
+    try:
+        filters = parse_search_filters(data)
+    except ValueError as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 400
+
+    async def events():
+        # The trace is started here: the generator runs after the handler has returned
+        trace = metrics.start_trace() if data.get('trace') else None
+        try:
+            with metrics.SEARCH_SECONDS.labels('stream').time():
+                async for event, payload in email_analyzer.stream_search(question, limit, score_threshold=0.5,
+                                                                         filters=filters):
+                    if event == "emails":
+                        yield sse_event("emails", {"relevant_emails": [serialize_email(email) for email in payload]})
+                    else:
+                        yield sse_event("token", {"content": payload})
+            if trace is not None:
+                yield sse_event("trace", trace.as_dict())
+            yield sse_event("done", {"status": "success"})
+        except Exception as e:
+            # The status line is already sent: the error is reported in the stream
+            yield sse_event("error", {"error": str(e), "status": "error"})
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # No server-side timeout on the body while the LLM is generating
+    response.timeout = None
+    return response
+
 @app.route('/api/v1/status', methods=['GET'])
 @require_analyzer()
-def get_status():
+async def get_status():
     """
     Get system status
     """
     try:
         return jsonify({
             "status": "operational",
-            "database_hash": email_analyzer.get_db_hash(),
+            "database_hash": await asyncio.to_thread(email_analyzer.get_db_hash),
+            "cache": email_analyzer.cache_stats(),
             "last_update": datetime.now().isoformat()
         })
     except Exception as e:
@@ -139,16 +252,40 @@ def get_status():
 
 @app.route('/api/v1/refresh', methods=['POST'])
 @require_analyzer()
-@async_route
 async def refresh_vector_store():
     """
-    Force refresh of vector store
+    Start a background rebuild of the vector store
     """
     try:
-        await email_analyzer.setup_vector_store(force_refresh=True)
+        job = await email_analyzer.start_rebuild()
+        return jsonify({
+            "status": "accepted",
+            "message": "Vector store rebuild running in background",
+            "job": job
+        }), 202
+    except Exception as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 500
+
+@app.route('/api/v1/refresh', methods=['GET'])
+@app.route('/api/v1/refresh/<int:job_id>', methods=['GET'])
+@require_analyzer()
+async def get_refresh_status(job_id=None):
+    """
+    Get progress, throughput and ETA of a rebuild job (the latest by default)
+    """
+    try:
+        job = await asyncio.to_thread(email_analyzer.rebuild_jobs.get_job, job_id)
+        if job is None:
+            return jsonify({
+                "error": "Rebuild job not found",
+                "status": "error"
+            }), 404
         return jsonify({
             "status": "success",
-            "message": "Vector store refreshed successfully"
+            "job": job
         })
     except Exception as e:
         return jsonify({
@@ -158,13 +295,12 @@ async def refresh_vector_store():
 
 # Initialize the analyzer on first request that needs it
 @app.route('/api/v1/initialize', methods=['POST'])
-@async_route
 async def initialize_analyzer():
     """
     Explicitly initialize the analyzer
     """
     try:
-        get_analyzer()
+        await get_analyzer()
         return jsonify({
             "status": "success",
             "message": "Analyzer initialized successfully"
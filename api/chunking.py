@@ -0,0 +1,40 @@
+from typing import List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # installé avec langchain-openai, mais optionnel
+    tiktoken = None
+
+# Sans tiktoken, un token est estimé à 4 caractères
+CHARS_PER_TOKEN = 4
+
+class TokenCounter:
+    """Compte et découpe le texte en tokens du modèle (estimation par caractères sans tiktoken)"""
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model_name or 'text-embedding-ada-002')
+            except KeyError:
+                self.encoding = tiktoken.get_encoding('cl100k_base')
+
+    def count(self, text: str) -> int:
+        if self.encoding is None:
+            return len(text) // CHARS_PER_TOKEN + 1
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def split(self, text: str, chunk_tokens: int, overlap_tokens: int = 0) -> List[str]:
+        """Découpe un texte en fenêtres d'au plus chunk_tokens tokens qui se chevauchent de overlap_tokens"""
+        if self.count(text) <= chunk_tokens:
+            return [text]
+        step = max(1, chunk_tokens - overlap_tokens)
+        if self.encoding is None:
+            size = chunk_tokens * CHARS_PER_TOKEN
+            step *= CHARS_PER_TOKEN
+            windows = range(0, max(len(text) - size, 0) + step, step)
+            return [text[start:start + size] for start in windows] or [text]
+
+        tokens = self.encoding.encode(text, disallowed_special=())
+        windows = range(0, max(len(tokens) - chunk_tokens, 0) + step, step)
+        return [self.encoding.decode(tokens[start:start + chunk_tokens]) for start in windows] or [text]
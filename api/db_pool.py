@@ -0,0 +1,54 @@
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+class ConnectionPool:
+    """Pool de connexions PostgreSQL partagé par les threads d'un worker
+
+    Les connexions sont réutilisées d'une requête à l'autre : une recherche n'ouvre
+    plus de connexion (TCP + authentification) à chaque accès à la base. Le pool
+    est créé à la première utilisation ; min_size connexions restent ouvertes, et
+    au-delà de max_size connexions simultanées les appelants attendent leur tour
+    au lieu d'échouer.
+    """
+
+    def __init__(self, min_size: int, max_size: int, **db_config):
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.db_config = db_config
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(self.min_size, self.max_size, **self.db_config)
+            return self._pool
+
+    @contextmanager
+    def connection(self):
+        """Prête une connexion pour la durée du bloc
+
+        La transaction éventuellement ouverte est annulée au retour dans le pool ;
+        une connexion fermée ou perdue (serveur redémarré...) n'y est pas remise.
+        """
+        with self._slots:
+            pool = self._get_pool()
+            conn = pool.getconn()
+            broken = False
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
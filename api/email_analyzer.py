@@ -1,27 +1,116 @@
 import asyncio
+import calendar
+import functools
+import re
+import time
+from email.utils import parseaddr
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
+import httpx
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema.runnable import RunnablePassthrough
 import os
-import psycopg2
 from psycopg2.extras import DictCursor
 import hashlib
-from chromadb.config import Settings
-import chromadb
 from langchain.docstore.document import Document
 from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
 import logging
 
+from chunking import TokenCounter
+from db_pool import ConnectionPool
+from embedding_cache import PostgresEmbeddingCache
+from embedding_scheduler import EmbeddingScheduler
+from metrics import observe_stage, timed
+from model_backends import create_chat_model, create_embeddings
+from query_cache import TTLCache, normalize_question
+from rebuild_jobs import RebuildJobStore
+from vector_store import create_vector_client
+
 logger = logging.getLogger(__name__)
 
+WORD_RE = re.compile(r'\w{3,}')
+
+def sender_address(sender: Optional[str]) -> str:
+    """Adresse email d'un expéditeur "Nom <adresse>", en minuscules"""
+    return (parseaddr(sender or '')[1] or sender or '').strip().lower()
+
+def to_timestamp(value: Optional[datetime]) -> int:
+    """Horodatage Unix d'une date (les dates sans fuseau sont en UTC), 0 si absente"""
+    if value is None:
+        return 0
+    return calendar.timegm(value.utctimetuple())
+
 class EmailAnalyzer:
+    # Empreinte des colonnes utilisées pour construire un document : un email
+    # dont l'empreinte change doit être ré-indexé. Le préfixe de version force la
+    # ré-indexation quand les métadonnées stockées changent.
+    CONTENT_HASH_SQL = "md5(concat_ws(E'\\x1f', 'v3', sender, subject, date::text, body)) AS content_hash"
+
+    # Configuration plein texte de la colonne emails.search_vector (créée par le fetcher)
+    TEXT_SEARCH_CONFIG = "french"
+
+    # Constante de la fusion par rang réciproque (RRF)
+    RRF_K = 60
+
+    # Nom logique de l'index : l'alias désigne la collection Chroma active
+    COLLECTION_ALIAS = "email_collection"
+
+    NO_RESULT_ANSWER = "Aucun email suffisamment pertinent n'a été trouvé pour répondre à cette question."
+
     def __init__(self):
-        self.embeddings = OpenAIEmbeddings()
-        self.chroma_client = None
+        # Client HTTP asynchrone partagé : les connexions vers OpenAI sont réutilisées
+        # d'une requête à l'autre sur la boucle d'événements du serveur ASGI
+        self.http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+        # Fournisseurs choisis par EMBEDDING_BACKEND / LLM_BACKEND (OpenAI ou simulés hors ligne)
+        self.embeddings = create_embeddings(self.http_client)
+        if os.getenv('EMBEDDING_CACHE', 'postgres') != 'off':
+            self.embeddings = PostgresEmbeddingCache(
+                self.embeddings,
+                self.db_connection,
+                max_entries=int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+            )
+        self.embedding_scheduler = EmbeddingScheduler(
+            self.embeddings,
+            concurrency=int(os.getenv('EMBEDDING_CONCURRENCY', '4')),
+            batch_tokens=int(os.getenv('EMBEDDING_BATCH_TOKENS', '50000')),
+            max_retries=int(os.getenv('EMBEDDING_MAX_RETRIES', '6'))
+        )
+        self.vector_client = None
         self.collection = None
-        self.llm = ChatOpenAI(model="gpt-4o-mini")
+        self.rebuild_jobs = RebuildJobStore(self.db_connection)
+        self.rebuild_task = None
+        self.alias_check_interval = float(os.getenv('ALIAS_CHECK_INTERVAL', '10'))
+        self.alias_checked_at = 0.0
+        # hybrid : recherche vectorielle + plein texte PostgreSQL ; vector : vectorielle seule
+        self.search_mode = os.getenv('SEARCH_MODE', 'hybrid')
+        self.candidate_factor = int(os.getenv('SEARCH_CANDIDATE_FACTOR', '4'))
+        # Pertinence plein texte minimale (ts_rank_cd normalisé entre 0 et 1) : un seul
+        # terme présent dans le corps vaut environ 0.17, dans l'objet 0.5
+        self.lexical_min_rank = float(os.getenv('LEXICAL_MIN_RANK', '0.2'))
+        # Découpage des emails longs et budget de contexte du prompt, en tokens
+        self.tokens = TokenCounter()
+        self.chunk_tokens = int(os.getenv('CHUNK_TOKENS', '512'))
+        self.chunk_overlap = int(os.getenv('CHUNK_OVERLAP', '64'))
+        self.context_token_budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))
+        self.context_chunks_per_email = int(os.getenv('CONTEXT_CHUNKS_PER_EMAIL', '3'))
+        # Version du corpus indexé (db_hash de la collection) : les réponses en cache
+        # ne sont valables que pour cette version
+        self.corpus_version = None
+        # Version de la table emails, lue en direct par la recherche plein texte : relue
+        # au plus toutes les ANSWER_CACHE_VERSION_INTERVAL secondes pour la clé des réponses
+        self.live_version = None
+        self.live_version_interval = float(os.getenv('ANSWER_CACHE_VERSION_INTERVAL', '10'))
+        self.live_version_checked_at = 0.0
+        self.query_embedding_cache = TTLCache(int(os.getenv('QUERY_CACHE_SIZE', '1000')), name='query_embedding')
+        self.answer_cache = TTLCache(
+            int(os.getenv('ANSWER_CACHE_SIZE', '500')),
+            ttl=float(os.getenv('ANSWER_CACHE_TTL', '3600')),
+            name='answer'
+        )
+        self.llm = create_chat_model(self.http_client)
         
         # Database configuration
         self.db_config = {
@@ -31,19 +120,45 @@ class EmailAnalyzer:
             'user': os.getenv('DB_USER', 'postgres'),
             'password': os.getenv('DB_PASSWORD', 'postgres')
         }
-        
-        # ChromaDB configuration
-        self.chroma_host = os.getenv('CHROMA_HOST', 'chroma')
-        self.chroma_port = os.getenv('CHROMA_PORT', '8000')
+        self.db_pool = ConnectionPool(
+            int(os.getenv('DB_POOL_MIN_SIZE', '5')),
+            int(os.getenv('DB_POOL_MAX_SIZE', '20')),
+            **self.db_config
+        )
     
-    def get_db_connection(self):
-        """Établit une connexion à la base de données PostgreSQL"""
-        return psycopg2.connect(**self.db_config)
+    async def aclose(self):
+        """Interrompt un rebuild en cours et ferme le client HTTP et les connexions partagés"""
+        if self.rebuild_task is not None and not self.rebuild_task.done():
+            self.rebuild_task.cancel()
+            await asyncio.gather(self.rebuild_task, return_exceptions=True)
+        await self.http_client.aclose()
+        self.db_pool.close()
+
+    def set_corpus_version(self, version: str):
+        """Enregistre la version du corpus indexé et invalide les réponses en cache si elle change"""
+        if version != self.corpus_version:
+            self.answer_cache.clear()
+            self.corpus_version = version
+
+    def cache_stats(self) -> dict:
+        """Compteurs des caches de requêtes, de réponses et d'embeddings"""
+        stats = {
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "answers": self.answer_cache.stats(),
+            "corpus_version": self.corpus_version
+        }
+        if isinstance(self.embeddings, PostgresEmbeddingCache):
+            stats["embeddings"] = {"hits": self.embeddings.hits, "misses": self.embeddings.misses}
+        return stats
+
+    def db_connection(self):
+        """Connexion PostgreSQL empruntée au pool, rendue à la fin du bloc with"""
+        return self.db_pool.connection()
 
     def get_db_hash(self):
         """Calcule un hash de la base de données emails"""
         try:
-            with self.get_db_connection() as conn:
+            with self.db_connection() as conn:
                 with conn.cursor() as cursor:
                     cursor.execute("SELECT MAX(date), COUNT(*) FROM emails")
                     result = cursor.fetchone()
@@ -52,183 +167,611 @@ class EmailAnalyzer:
             logger.error(f"Error calculating DB hash: {e}")
             raise
 
-    def prepare_email_documents(self):
-        """Prépare les documents à partir des emails en base de données"""
+    def get_email_hashes(self) -> Dict[str, str]:
+        """Retourne l'empreinte du contenu indexé de chaque email en base"""
+        try:
+            with self.db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"SELECT unique_id, {self.CONTENT_HASH_SQL} FROM emails")
+                    return dict(cursor.fetchall())
+        except Exception as e:
+            logger.error(f"Error fetching email hashes: {e}")
+            raise
+
+    def get_indexed_chunks(self) -> Dict[str, dict]:
+        """Retourne, pour chaque email indexé, l'empreinte de son contenu et les identifiants de ses documents"""
+        indexed = {}
+        page_size = 5000
+        offset = 0
+        while True:
+            page = self.collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            for doc_id, metadata in zip(page['ids'], page['metadatas']):
+                metadata = metadata or {}
+                entry = indexed.setdefault(metadata.get('email_id', doc_id), {
+                    "content_hash": metadata.get('content_hash'),
+                    "ids": []
+                })
+                # Des documents d'empreintes différentes : l'email doit être ré-indexé
+                if entry["content_hash"] != metadata.get('content_hash'):
+                    entry["content_hash"] = None
+                entry["ids"].append(doc_id)
+            if len(page['ids']) < page_size:
+                return indexed
+            offset += page_size
+
+    def format_document(self, email, body: Optional[str]) -> str:
+        """Texte vectorisé pour un email (ou l'un de ses morceaux)"""
+        return f"""
+                        De: {email['sender']}
+                        Objet: {email['subject']}
+                        Date: {email['date']}
+                        
+                        {body}
+                        """
+
+    def chunk_email(self, email) -> Tuple[List[str], List[dict], List[str]]:
+        """Découpe un email en documents d'au plus chunk_tokens tokens, rattachés à l'email par email_id"""
+        bodies = self.tokens.split(email['body'], self.chunk_tokens, self.chunk_overlap) if email['body'] else [email['body']]
+        metadata = self.document_metadata(email)
+        texts, metadatas, ids = [], [], []
+        for index, body in enumerate(bodies):
+            texts.append(self.format_document(email, body))
+            metadatas.append({**metadata, "chunk_index": index, "chunk_count": len(bodies)})
+            ids.append(f"{email['unique_id']}:{index}")
+        return texts, metadatas, ids
+
+    def document_metadata(self, email) -> dict:
+        """Métadonnées Chroma d'un email, dont celles utilisées par les filtres de recherche"""
+        return {
+            "sender": email['sender'],
+            "sender_address": sender_address(email['sender']),
+            "subject": email['subject'],
+            "date": str(email['date']),
+            "timestamp": to_timestamp(email['date']),
+            "email_id": email['unique_id'],
+            "content_hash": email['content_hash']
+        }
+
+    def prepare_email_documents(self, unique_ids: Optional[List[str]] = None, batch_size: int = 1000):
+        """Génère par lots les documents à vectoriser (tous les emails, ou ceux demandés)
+
+        Les emails sont lus avec un curseur serveur : seul le lot courant est en
+        mémoire. Chaque lot est un tuple (texts, metadatas, ids) couvrant au plus
+        batch_size emails, chacun découpé en un ou plusieurs documents.
+        """
         try:
-            with self.get_db_connection() as conn:
-                with conn.cursor(cursor_factory=DictCursor) as cursor:
-                    cursor.execute("""
-                        SELECT sender, subject, date, body, unique_id 
+            with self.db_connection() as conn, conn:
+                with conn.cursor(name='email_documents', cursor_factory=DictCursor) as cursor:
+                    cursor.itersize = batch_size
+                    cursor.execute(f"""
+                        SELECT sender, subject, date, body, unique_id, {self.CONTENT_HASH_SQL}
                         FROM emails 
+                        {"WHERE unique_id = ANY(%s)" if unique_ids is not None else ""}
                         ORDER BY date DESC
-                    """)
+                    """, (unique_ids,) if unique_ids is not None else None)
                     
-                    documents = []
                     metadatas = []
                     ids = []
                     texts = []
+                    email_count = 0
                     
                     for email in cursor:
-                        content = f"""
-                        De: {email['sender']}
-                        Objet: {email['subject']}
-                        Date: {email['date']}
-                        
-                        {email['body']}
-                        """
-                        
-                        documents.append(Document(
-                            page_content=content,
-                            metadata={
-                                "sender": email['sender'],
-                                "subject": email['subject'],
-                                "date": str(email['date']),
-                                "email_id": email['unique_id']
-                            }
-                        ))
-                        
-                        texts.append(content)
-                        metadatas.append({
-                            "sender": email['sender'],
-                            "subject": email['subject'],
-                            "date": str(email['date']),
-                            "email_id": email['unique_id']
-                        })
-                        ids.append(email['unique_id'])
+                        chunk_texts, chunk_metadatas, chunk_ids = self.chunk_email(email)
+                        texts.extend(chunk_texts)
+                        metadatas.extend(chunk_metadatas)
+                        ids.extend(chunk_ids)
+                        email_count += 1
+
+                        if email_count >= batch_size:
+                            yield texts, metadatas, ids
+                            metadatas = []
+                            ids = []
+                            texts = []
+                            email_count = 0
                     
-                    return documents, texts, metadatas, ids
+                    if ids:
+                        yield texts, metadatas, ids
         except Exception as e:
             logger.error(f"Error preparing email documents: {e}")
             raise
 
-    async def setup_vector_store(self, force_refresh: bool = False):
-        """Initialise ou charge la base de données vectorielle"""
+    def delete_documents(self, ids: List[str], batch_size: int = 100):
+        """Supprime des documents de la collection active, par lots"""
+        for i in range(0, len(ids), batch_size):
+            self.collection.delete(ids=ids[i:i + batch_size])
+
+    def count_emails(self) -> int:
+        with self.db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM emails")
+                return cursor.fetchone()[0]
+
+    def store_documents(self, texts: List[str], metadatas: List[dict], ids: List[str],
+                        embeddings: List[List[float]], collection=None):
+        """Ajoute ou remplace un lot de documents vectorisés dans la collection (active par défaut)"""
+        (collection or self.collection).upsert(
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=metadatas,
+            ids=ids
+        )
+
+    def connect_vector_store(self):
+        """Connecte le client de base vectorielle (VECTOR_BACKEND), réutilisé entre les rafraîchissements"""
+        if self.vector_client is None:
+            self.vector_client = create_vector_client()
+        return self.vector_client
+
+    def open_collection(self):
+        """Ouvre la collection désignée par l'alias (ou la collection historique sans alias)"""
+        collection_name = self.rebuild_jobs.get_active_collection(self.COLLECTION_ALIAS) or self.COLLECTION_ALIAS
+        
+        # Crée ou récupère la collection
+        self.collection = self.connect_vector_store().get_or_create_collection(
+            name=collection_name,
+            metadata={"hnsw:space": "cosine"}
+        )
+        self.alias_checked_at = time.monotonic()
+
+    async def follow_alias(self):
+        """Bascule sur la collection active si un rebuild (éventuellement d'un autre worker) l'a remplacée"""
+        if time.monotonic() - self.alias_checked_at < self.alias_check_interval:
+            return
+        self.alias_checked_at = time.monotonic()
+        
+        active = await asyncio.to_thread(self.rebuild_jobs.get_active_collection, self.COLLECTION_ALIAS)
+        if active and active != self.collection.name:
+            logger.info(f"Switching to collection {active}")
+            self.collection = await asyncio.to_thread(self.connect_vector_store().get_collection, active)
+            self.set_corpus_version((self.collection.metadata or {}).get('db_hash'))
+
+    def drop_stale_collections(self, keep: List[str]):
+        """Supprime les anciennes générations de l'index, hors collections à conserver"""
+        client = self.connect_vector_store()
+        for col in client.list_collections():
+            name = getattr(col, 'name', col)
+            if name.startswith(self.COLLECTION_ALIAS) and name not in keep:
+                client.delete_collection(name)
+                logger.info(f"Dropped stale collection {name}")
+
+    async def start_rebuild(self) -> dict:
+        """
+        Lance la reconstruction complète de l'index en tâche de fond
+        
+        Retourne le job créé, ou le job déjà en cours le cas échéant.
+        """
+        collection_name = f"{self.COLLECTION_ALIAS}_{datetime.now():%Y%m%d%H%M%S%f}"
+        job = await asyncio.to_thread(self.rebuild_jobs.create_job, collection_name)
+        if job is None:
+            return await asyncio.to_thread(self.rebuild_jobs.get_running_job)
+        
+        self.rebuild_task = asyncio.create_task(self.rebuild_vector_store(job['id'], collection_name))
+        return job
+
+    async def rebuild_vector_store(self, job_id: int, collection_name: str):
+        """
+        Construit une nouvelle collection à côté de la collection active, puis bascule l'alias
+        
+        Les recherches continuent sur la collection active pendant toute la construction.
+        """
+        collection = None
         try:
-            # Connexion au serveur ChromaDB
-            self.chroma_client = chromadb.HttpClient(
-                host=self.chroma_host,
-                port=self.chroma_port,
-                settings=Settings(anonymized_telemetry=False)
+            collection = await asyncio.to_thread(
+                self.connect_vector_store().create_collection,
+                name=collection_name,
+                metadata={"hnsw:space": "cosine"}
             )
+            # Hash pris avant la lecture : un email ajouté pendant le rebuild sera repris par la synchro suivante
+            current_hash = await asyncio.to_thread(self.get_db_hash)
+            total = await asyncio.to_thread(self.count_emails)
+            await asyncio.to_thread(self.rebuild_jobs.update_progress, job_id, total, 0)
+            logger.info(f"Rebuilding vector store into {collection_name}: {total} emails")
             
-            collection_name = "email_collection"
+            store = functools.partial(self.store_documents, collection=collection)
+            indexed_count = 0
+            batches = self.prepare_email_documents()
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                texts, metadatas, ids = batch
+                await self.embedding_scheduler.embed_and_store(texts, metadatas, ids, store)
+                indexed_count += len({metadata["email_id"] for metadata in metadatas})
+                await asyncio.to_thread(self.rebuild_jobs.update_progress, job_id, max(total, indexed_count), indexed_count)
             
-            # Supprime la collection si force_refresh est True
-            if force_refresh and collection_name in [col.name for col in self.chroma_client.list_collections()]:
-                self.chroma_client.delete_collection(collection_name)
+            await asyncio.to_thread(collection.modify, metadata={"db_hash": current_hash})
             
-            # Crée ou récupère la collection
-            self.collection = self.chroma_client.get_or_create_collection(
-                name=collection_name,
-                metadata={"hnsw:space": "cosine"}
-            )
+            # Bascule atomique : les nouvelles recherches utilisent la nouvelle collection
+            previous = await asyncio.to_thread(self.rebuild_jobs.swap_alias, self.COLLECTION_ALIAS, collection_name)
+            self.collection = collection
+            self.set_corpus_version(current_hash)
+            await asyncio.to_thread(self.rebuild_jobs.finish_job, job_id)
+            logger.info(f"Vector store rebuilt: {indexed_count} emails indexed into {collection_name}")
+            
+            # La génération précédente est conservée le temps que les autres workers basculent
+            keep = [collection_name] + ([previous] if previous else [self.COLLECTION_ALIAS])
+            await asyncio.to_thread(self.drop_stale_collections, keep)
+            
+        except (Exception, asyncio.CancelledError) as e:
+            logger.error(f"Vector store rebuild {job_id} failed: {e!r}")
+            await asyncio.to_thread(self.rebuild_jobs.finish_job, job_id, str(e) or type(e).__name__)
+            if collection is not None and self.collection is not collection:
+                try:
+                    await asyncio.to_thread(self.connect_vector_store().delete_collection, collection_name)
+                except Exception as cleanup_error:
+                    logger.warning(f"Could not drop collection {collection_name}: {cleanup_error}")
+            if isinstance(e, asyncio.CancelledError):
+                raise
+
+    async def setup_vector_store(self, force_refresh: bool = False):
+        """
+        Initialise ou charge la base de données vectorielle
+        
+        Synchronise la collection active avec la base ; force_refresh ignore le hash
+        enregistré et compare tous les emails. La reconstruction complète passe par start_rebuild.
+        """
+        try:
+            # Les appels ChromaDB et PostgreSQL sont bloquants : ils sont exécutés
+            # hors de la boucle d'événements
+            await asyncio.to_thread(self.open_collection)
             
             # Vérifie si une mise à jour est nécessaire
-            current_hash = self.get_db_hash()
+            current_hash = await asyncio.to_thread(self.get_db_hash)
             collection_metadata = self.collection.metadata
             if not force_refresh and collection_metadata and collection_metadata.get('db_hash') == current_hash:
                 logger.info("Vector database is up to date")
+                self.set_corpus_version(current_hash)
                 return
             
-            # Prépare et ajoute les documents
-            documents, texts, metadatas, ids = self.prepare_email_documents()
-            
-            # Ajoute les documents par lots
-            batch_size = 100
-            for i in range(0, len(texts), batch_size):
-                batch_texts = texts[i:i + batch_size]
-                batch_metadatas = metadatas[i:i + batch_size]
-                batch_ids = ids[i:i + batch_size]
-                
-                embeddings = self.embeddings.embed_documents(batch_texts)
-                
-                self.collection.add(
-                    embeddings=embeddings,
-                    documents=batch_texts,
-                    metadatas=batch_metadatas,
-                    ids=batch_ids
-                )
+            # Compare les emails en base à ceux déjà indexés
+            email_hashes = await asyncio.to_thread(self.get_email_hashes)
+            indexed = await asyncio.to_thread(self.get_indexed_chunks)
+            removed_ids = [
+                doc_id for email_id, entry in indexed.items() if email_id not in email_hashes
+                for doc_id in entry["ids"]
+            ]
+            changed_ids = [
+                unique_id for unique_id, content_hash in email_hashes.items()
+                if unique_id not in indexed or indexed[unique_id]["content_hash"] != content_hash
+            ]
+
+            # Supprime les documents des emails qui ne sont plus en base
+            await asyncio.to_thread(self.delete_documents, removed_ids)
+            
+            # Prépare et ajoute uniquement les documents nouveaux ou modifiés, lot par lot
+            indexed_count = 0
+            if changed_ids:
+                batches = self.prepare_email_documents(changed_ids)
+                while True:
+                    batch = await asyncio.to_thread(next, batches, None)
+                    if batch is None:
+                        break
+                    texts, metadatas, ids = batch
+                    # Vectorise par lots concurrents, l'écriture dans Chroma se superpose aux requêtes suivantes
+                    await self.embedding_scheduler.embed_and_store(texts, metadatas, ids, self.store_documents)
+                    
+                    # Supprime les anciens morceaux des emails ré-indexés qui n'ont pas été remplacés
+                    email_ids = {metadata["email_id"] for metadata in metadatas}
+                    new_ids = set(ids)
+                    stale_ids = [
+                        doc_id for email_id in email_ids
+                        for doc_id in indexed.get(email_id, {}).get("ids", []) if doc_id not in new_ids
+                    ]
+                    await asyncio.to_thread(self.delete_documents, stale_ids)
+                    removed_ids.extend(stale_ids)
+                    indexed_count += len(email_ids)
             
             # Met à jour le hash de la base
-            self.collection.modify(metadata={"db_hash": current_hash})
-            logger.info("Vector database updated successfully")
+            await asyncio.to_thread(self.collection.modify, metadata={"db_hash": current_hash})
+            self.set_corpus_version(current_hash)
+            logger.info(f"Vector database updated successfully: {indexed_count} emails indexed, "
+                        f"{len(removed_ids)} documents removed")
             
         except Exception as e:
             logger.error(f"Failed to setup vector store: {e}")
             raise
 
-    async def search_with_context(self, question: str, limit: int = 3, score_threshold: float = 0.5):
+    async def retrieve(self, question: str, limit: int = 3, score_threshold: float = 0.5,
+                       filters: Optional[dict] = None) -> List[Document]:
         """
-        Recherche dans les emails et retourne la réponse AI et les emails pertinents
+        Recherche les emails pertinents pour la question
         
-        Args:
-            question (str): La question à rechercher
-            limit (int): Nombre maximum de résultats à retourner
-            score_threshold (float): Score minimum de similarité (entre 0 et 1) pour inclure un résultat
+        Les résultats vectoriels (similarité >= score_threshold) et plein texte
+        (pertinence >= lexical_min_rank, score_threshold ne s'appliquant qu'aux
+        similarités vectorielles) sont fusionnés par rang réciproque. filters accepte sender (adresse), date_from et
+        date_to (datetime), appliqués dans Chroma comme dans PostgreSQL. Les meilleurs
+        morceaux sont retenus dans la limite de context_token_budget tokens, et
+        regroupés en un document par email.
         """
         if not self.collection:
             raise Exception("Vector store not initialized")
         
-        try:
-            # Obtient l'embedding de la question
-            question_embedding = self.embeddings.embed_query(question)
-            
-            # Recherche les documents pertinents avec scores
-            results = self.collection.query(
+        await self.follow_alias()
+        
+        filters = filters or {}
+        candidates = max(limit * self.candidate_factor, limit)
+        if self.search_mode == 'hybrid':
+            rankings = await asyncio.gather(
+                self.vector_search(question, candidates, score_threshold, filters),
+                self.lexical_search(question, candidates, filters)
+            )
+        else:
+            rankings = [await self.vector_search(question, candidates, score_threshold, filters)]
+        return self.pack_context(self.fuse_results(rankings, limit))
+
+    async def vector_search(self, question: str, limit: int, score_threshold: float,
+                            filters: dict) -> List[Document]:
+        """Recherche vectorielle dans Chroma, triée par similarité décroissante"""
+        # Obtient l'embedding de la question, mis en cache par question normalisée
+        normalized = normalize_question(question)
+        question_embedding = self.query_embedding_cache.get(normalized)
+        if question_embedding is None:
+            with timed('embed_query'):
+                question_embedding = await self.embeddings.aembed_query(normalized)
+            self.query_embedding_cache.set(normalized, question_embedding)
+        
+        # Recherche les documents pertinents avec scores
+        with timed('vector_query'):
+            results = await asyncio.to_thread(
+                self.collection.query,
                 query_embeddings=[question_embedding],
                 n_results=limit,
+                where=self.chroma_where(filters),
                 include=["documents", "metadatas", "distances"]
             )
-            
-            # Convertit les distances en scores de similarité (1 - distance normalisée)
-            scores = [1 - min(1, dist) for dist in results['distances'][0]]
-            
-            # Filtre les résultats selon le score minimum
-            filtered_results = []
-            filtered_metadata = []
-            for doc, metadata, score in zip(results['documents'][0], results['metadatas'][0], scores):
-                if score >= score_threshold:
-                    filtered_results.append(doc)
-                    filtered_metadata.append(metadata)
-            
-            # Si aucun résultat ne dépasse le seuil
-            if not filtered_results:
-                return "Aucun email suffisamment pertinent n'a été trouvé pour répondre à cette question.", []
-            
-            # Prépare les documents filtrés
-            documents = []
-            for doc, metadata in zip(filtered_results, filtered_metadata):
+        
+        # Convertit les distances en scores de similarité (1 - distance normalisée)
+        scores = [1 - min(1, dist) for dist in results['distances'][0]]
+        
+        # Filtre les résultats selon le score minimum
+        documents = []
+        for doc, metadata, score in zip(results['documents'][0], results['metadatas'][0], scores):
+            if score >= score_threshold:
                 documents.append(Document(
                     page_content=doc,
                     metadata=metadata
                 ))
-            
-            context = "\n---\n".join(filtered_results)
-            
-            # Prépare et exécute la requête
-            prompt = ChatPromptTemplate.from_template("""
-                En te basant sur le contexte des emails suivants, réponds à cette question :
-                "{question}"
+        return documents
 
-                Contexte des emails :
-                {context}
+    async def lexical_search(self, question: str, limit: int, filters: dict) -> List[Document]:
+        """Recherche plein texte, ignorée (avec un avertissement) si l'index est indisponible"""
+        try:
+            with timed('lexical_query'):
+                return await asyncio.to_thread(self.lexical_query, question, limit, filters)
+        except Exception as e:
+            logger.warning(f"Full-text search unavailable, using vector results only: {e}")
+            return []
+
+    def lexical_query(self, question: str, limit: int, filters: dict) -> List[Document]:
+        """
+        Emails dont search_vector contient au moins un terme de la question, par pertinence
+        (au moins lexical_min_rank)
+        
+        Chaque email est découpé comme à l'indexation ; ses morceaux sont classés
+        par nombre de mots de la question qu'ils contiennent.
+        """
+        # plainto_tsquery combine les termes par ET : une question en langage naturel
+        # ne correspondrait presque jamais, les termes sont donc combinés par OU
+        conditions = ["search_vector @@ q.query", "r.rank >= %s"]
+        params = [self.TEXT_SEARCH_CONFIG, question, self.lexical_min_rank]
+        if filters.get('sender'):
+            conditions.append("lower(coalesce(substring(sender from '<([^>]+)>'), sender)) = %s")
+            params.append(filters['sender'].strip().lower())
+        if filters.get('date_from'):
+            conditions.append("date >= %s")
+            params.append(filters['date_from'])
+        if filters.get('date_to'):
+            conditions.append("date <= %s")
+            params.append(filters['date_to'])
+        params.append(limit)
+        
+        with self.db_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT sender, subject, date, body, unique_id, {self.CONTENT_HASH_SQL}
+                    FROM emails,
+                        LATERAL (
+                            SELECT NULLIF(replace(plainto_tsquery(%s::regconfig, %s)::text, ' & ', ' | '), '')::tsquery AS query
+                        ) q,
+                        LATERAL (SELECT ts_rank_cd(search_vector, q.query, 32) AS rank) r
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY r.rank DESC
+                    LIMIT %s
+                """, params)
+                emails = cursor.fetchall()
+        
+        words = set(WORD_RE.findall(question.casefold()))
+        documents = []
+        for email in emails:
+            texts, metadatas, _ = self.chunk_email(email)
+            chunks = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+            chunks.sort(key=lambda chunk: -sum(word in chunk.page_content.casefold() for word in words))
+            documents.extend(chunks)
+        return documents
+
+    def chroma_where(self, filters: dict) -> Optional[dict]:
+        """Traduit les filtres de recherche en clause where Chroma"""
+        conditions = []
+        if filters.get('sender'):
+            conditions.append({"sender_address": filters['sender'].strip().lower()})
+        if filters.get('date_from'):
+            conditions.append({"timestamp": {"$gte": to_timestamp(filters['date_from'])}})
+        if filters.get('date_to'):
+            conditions.append({"timestamp": {"$lte": to_timestamp(filters['date_to'])}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
 
-                Si la réponse ne peut pas être trouvée dans les emails, dis-le clairement.
-                Réponse :
-                """)
+    def fuse_results(self, rankings: Sequence[List[Document]], limit: int) -> List[List[Document]]:
+        """
+        Fusion par rang réciproque de plusieurs classements de morceaux, au niveau des emails
+        
+        Retourne les limit meilleurs emails, chacun avec ses morceaux candidats du plus
+        pertinent au moins pertinent.
+        """
+        scores = {}
+        chunks = {}
+        for ranking in rankings:
+            email_rank = {}
+            for document in ranking:
+                email_id = document.metadata["email_id"]
+                email_rank.setdefault(email_id, len(email_rank))
+                candidates = chunks.setdefault(email_id, [])
+                chunk_index = document.metadata.get("chunk_index", 0)
+                if all(chunk.metadata.get("chunk_index", 0) != chunk_index for chunk in candidates):
+                    candidates.append(document)
+            for email_id, rank in email_rank.items():
+                scores[email_id] = scores.get(email_id, 0.0) + 1.0 / (self.RRF_K + rank + 1)
+        
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [chunks[email_id] for email_id in best]
+
+    def pack_context(self, emails: List[List[Document]]) -> List[Document]:
+        """
+        Retient les meilleurs morceaux de chaque email dans la limite du budget de tokens
+        
+        Retourne un document par email, ses morceaux retenus dans l'ordre du texte.
+        """
+        budget = self.context_token_budget
+        documents = []
+        for candidates in emails:
+            selected = []
+            for chunk in candidates[:self.context_chunks_per_email]:
+                cost = self.tokens.count(chunk.page_content)
+                if cost <= budget:
+                    budget -= cost
+                    selected.append(chunk)
+            if not selected:
+                continue
             
-            chain = (
-                {
-                    "context": RunnablePassthrough(),
-                    "question": lambda x: question
-                }
-                | prompt
-                | self.llm
-            )
+            metadata = selected[0].metadata
+            selected.sort(key=lambda chunk: chunk.metadata.get("chunk_index", 0))
+            documents.append(Document(
+                page_content="\n[...]\n".join(chunk.page_content for chunk in selected),
+                metadata=metadata
+            ))
+        return documents
+
+    async def refresh_live_version(self):
+        """Relit la version de la table emails si elle date de plus de live_version_interval secondes
+
+        Un nouvel email modifie les résultats plein texte sans changer la version du
+        corpus indexé : les réponses en cache sont donc aussi rattachées à cette version.
+        """
+        if self.search_mode != 'hybrid':
+            return
+        if time.monotonic() - self.live_version_checked_at < self.live_version_interval:
+            return
+        self.live_version_checked_at = time.monotonic()
+        try:
+            self.live_version = await asyncio.to_thread(self.get_db_hash)
+        except Exception as e:
+            logger.warning(f"Could not refresh emails table version: {e}")
+
+    def answer_cache_key(self, question: str, limit: int, score_threshold: float, filters: Optional[dict] = None):
+        filter_key = tuple(sorted((key, str(value)) for key, value in (filters or {}).items() if value))
+        return (normalize_question(question), limit, score_threshold, filter_key,
+                self.corpus_version, self.live_version)
+
+    def build_prompt(self, question: str):
+        """Chaîne qui construit, à partir du contexte des emails, le prompt envoyé au LLM"""
+        prompt = ChatPromptTemplate.from_template("""
+            En te basant sur le contexte des emails suivants, réponds à cette question :
+            "{question}"
+
+            Contexte des emails :
+            {context}
+
+            Si la réponse ne peut pas être trouvée dans les emails, dis-le clairement.
+            Réponse :
+            """)
         
-            response = await chain.ainvoke(context)
+        return (
+            {
+                "context": RunnablePassthrough(),
+                "question": lambda x: question
+            }
+            | prompt
+        )
+
+    async def search_with_context(self, question: str, limit: int = 3, score_threshold: float = 0.5,
+                                  filters: Optional[dict] = None):
+        """
+        Recherche dans les emails et retourne la réponse AI et les emails pertinents
+        
+        Args:
+            question (str): La question à rechercher
+            limit (int): Nombre maximum de résultats à retourner
+            score_threshold (float): Score minimum de similarité (entre 0 et 1) pour inclure un résultat
+            filters (dict): Filtres optionnels sender, date_from et date_to
+        """
+        try:
+            await self.follow_alias()
+            await self.refresh_live_version()
+            cache_key = self.answer_cache_key(question, limit, score_threshold, filters)
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
+            documents = await self.retrieve(question, limit, score_threshold, filters)
+            
+            # Si aucun résultat ne dépasse le seuil
+            if not documents:
+                return self.NO_RESULT_ANSWER, []
+            
+            context = "\n---\n".join(doc.page_content for doc in documents)
+            with timed('prompt_build'):
+                prompt = await self.build_prompt(question).ainvoke(context)
+            with timed('llm'):
+                response = await self.llm.ainvoke(prompt)
+            self.answer_cache.set(cache_key, (response.content, documents))
             return response.content, documents
             
         except Exception as e:
             logger.error(f"Error during search: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    async def stream_search(self, question: str, limit: int = 3, score_threshold: float = 0.5,
+                            filters: Optional[dict] = None):
+        """
+        Variante en flux de search_with_context
+        
+        Produit d'abord ("emails", documents) dès la fin de la recherche, puis
+        ("token", texte) pour chaque fragment de réponse généré par le LLM.
+        """
+        try:
+            await self.follow_alias()
+            await self.refresh_live_version()
+            cache_key = self.answer_cache_key(question, limit, score_threshold, filters)
+            cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                answer, documents = cached
+                yield "emails", documents
+                yield "token", answer
+                return
+            
+            documents = await self.retrieve(question, limit, score_threshold, filters)
+            yield "emails", documents
+            
+            if not documents:
+                yield "token", self.NO_RESULT_ANSWER
+                return
+            
+            context = "\n---\n".join(doc.page_content for doc in documents)
+            with timed('prompt_build'):
+                prompt = await self.build_prompt(question).ainvoke(context)
+            tokens = []
+            started = time.perf_counter()
+            async for chunk in self.llm.astream(prompt):
+                if chunk.content:
+                    if not tokens:
+                        observe_stage('llm_first_token', time.perf_counter() - started)
+                    tokens.append(chunk.content)
+                    yield "token", chunk.content
+            observe_stage('llm', time.perf_counter() - started)
+            # Une réponse interrompue par le client n'est pas mise en cache
+            self.answer_cache.set(cache_key, ("".join(tokens), documents))
+                    
+        except Exception as e:
+            logger.error(f"Error during streamed search: {e}")
+            raise
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from psycopg2.extras import execute_values
+
+from metrics import count_cache
+
+logger = logging.getLogger(__name__)
+
+class PostgresEmbeddingCache(Embeddings):
+    """Cache persistant des embeddings, adressé par le contenu
+
+    Chaque vecteur est stocké dans PostgreSQL sous la clé sha256(modèle, type, texte) :
+    un texte déjà vectorisé n'est plus envoyé au fournisseur, même après la
+    reconstruction complète de la collection. Le cache est borné à max_entries
+    entrées, les moins récemment utilisées étant supprimées en premier.
+    """
+
+    # Nombre d'insertions entre deux passes d'éviction
+    EVICTION_INTERVAL = 1000
+
+    def __init__(self, embeddings: Embeddings, connection: Callable, max_entries: int = 200000,
+                 model_name: Optional[str] = None):
+        self.embeddings = embeddings
+        self.connection = connection
+        self.max_entries = max_entries
+        self.model_name = model_name or getattr(embeddings, 'model', type(embeddings).__name__)
+        self.hits = 0
+        self.misses = 0
+        self._inserted_since_eviction = 0
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    def _execute(self, callback):
+        """Exécute callback(cursor) dans une transaction, sur une connexion empruntée au pool"""
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor() as cursor:
+                    if not self._schema_ready:
+                        cursor.execute("""
+                            CREATE TABLE IF NOT EXISTS embedding_cache (
+                                key TEXT PRIMARY KEY,
+                                model TEXT NOT NULL,
+                                embedding REAL[] NOT NULL,
+                                last_used TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                            );
+
+                            CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used
+                                ON embedding_cache(last_used);
+                        """)
+                        self._schema_ready = True
+                    return callback(cursor)
+
+    def cache_key(self, text: str, kind: str) -> str:
+        """Clé du cache : empreinte du modèle, du type (document/requête) et du texte"""
+        return hashlib.sha256(f"{self.model_name}\x1f{kind}\x1f{text}".encode()).hexdigest()
+
+    def lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Récupère les vecteurs en cache et rafraîchit leur date d'utilisation"""
+        def query(cursor):
+            cursor.execute(
+                "SELECT key, embedding FROM embedding_cache WHERE key = ANY(%s)",
+                (list(set(keys)),)
+            )
+            found = dict(cursor.fetchall())
+            if found:
+                # Limite les écritures : la date n'est rafraîchie qu'une fois par heure
+                cursor.execute("""
+                    UPDATE embedding_cache SET last_used = CURRENT_TIMESTAMP
+                    WHERE key = ANY(%s) AND last_used < CURRENT_TIMESTAMP - INTERVAL '1 hour'
+                """, (list(found),))
+            return found
+
+        try:
+            return self._execute(query)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            return {}
+
+    def store(self, entries: Dict[str, List[float]]):
+        """Enregistre de nouveaux vecteurs puis évince les plus anciens si nécessaire"""
+        if not entries:
+            return
+
+        def insert(cursor):
+            execute_values(cursor, """
+                INSERT INTO embedding_cache (key, model, embedding)
+                VALUES %s
+                ON CONFLICT (key) DO NOTHING
+            """, [(key, self.model_name, embedding) for key, embedding in entries.items()])
+
+        try:
+            self._execute(insert)
+        except Exception as e:
+            logger.warning(f"Embedding cache store failed: {e}")
+            return
+
+        with self._lock:
+            self._inserted_since_eviction += len(entries)
+            if self._inserted_since_eviction < self.EVICTION_INTERVAL:
+                return
+            self._inserted_since_eviction = 0
+        self.evict()
+
+    def evict(self) -> int:
+        """Supprime les entrées les moins récemment utilisées au-delà de max_entries"""
+        def delete(cursor):
+            cursor.execute("""
+                DELETE FROM embedding_cache
+                WHERE key IN (
+                    SELECT key FROM embedding_cache
+                    ORDER BY last_used DESC
+                    OFFSET %s
+                )
+            """, (self.max_entries,))
+            return cursor.rowcount
+
+        try:
+            removed = self._execute(delete)
+            if removed:
+                logger.info(f"Evicted {removed} entries from embedding cache")
+            return removed
+        except Exception as e:
+            logger.warning(f"Embedding cache eviction failed: {e}")
+            return 0
+
+    def _missing(self, keys: List[str], texts: List[str], cached: Dict[str, List[float]]) -> Dict[str, str]:
+        """Textes absents du cache (dédupliqués par clé) ; met à jour les compteurs"""
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        count_cache('embedding', hits=len(keys) - len(missing), misses=len(missing))
+        return missing
+
+    def _embed(self, texts: List[str], kind: str, compute: Callable) -> List[List[float]]:
+        keys = [self.cache_key(text, kind) for text in texts]
+        cached = self.lookup(keys)
+        missing = self._missing(keys, texts, cached)
+
+        if missing:
+            computed = dict(zip(missing, compute(list(missing.values()))))
+            self.store(computed)
+            cached.update(computed)
+
+        return [list(cached[key]) for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, 'document', self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], 'query', lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache_key(text, 'document') for text in texts]
+        cached = await asyncio.to_thread(self.lookup, keys)
+        missing = self._missing(keys, texts, cached)
+
+        if missing:
+            computed = dict(zip(missing, await self.embeddings.aembed_documents(list(missing.values()))))
+            await asyncio.to_thread(self.store, computed)
+            cached.update(computed)
+
+        return [list(cached[key]) for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self.cache_key(text, 'query')
+        cached = await asyncio.to_thread(self.lookup, [key])
+        if key in cached:
+            self.hits += 1
+            count_cache('embedding', hits=1)
+            return list(cached[key])
+
+        self.misses += 1
+        count_cache('embedding', misses=1)
+        embedding = await self.embeddings.aembed_query(text)
+        await asyncio.to_thread(self.store, {key: embedding})
+        return embedding
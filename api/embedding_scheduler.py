@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import random
+import re
+from typing import Callable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from chunking import TokenCounter
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+class AdaptiveLimiter:
+    """Limite de concurrence ajustée selon les réponses du fournisseur
+
+    La limite est divisée par deux à chaque limitation de débit (429) et
+    remonte d'un cran à chaque succès, sans dépasser max_concurrency.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.max_concurrency, self.limit + 1)
+
+    def on_rate_limit(self):
+        self.limit = max(1, self.limit // 2)
+
+class EmbeddingScheduler:
+    """Vectorise des documents par lots bornés en tokens, avec plusieurs requêtes en parallèle
+
+    L'enregistrement de chaque lot (callback store) s'exécute dans un thread et
+    se superpose aux requêtes d'embedding suivantes.
+    """
+
+    def __init__(self, embeddings: Embeddings, concurrency: int = 4, batch_tokens: int = 50000,
+                 batch_max_docs: int = 256, max_retries: int = 6, model_name: Optional[str] = None):
+        self.embeddings = embeddings
+        self.concurrency = concurrency
+        self.batch_tokens = batch_tokens
+        self.batch_max_docs = batch_max_docs
+        self.max_retries = max_retries
+        self.tokens = TokenCounter(model_name)
+
+    def count_tokens(self, text: str) -> int:
+        """Nombre de tokens d'un texte (estimation à 4 caractères par token sans tiktoken)"""
+        return self.tokens.count(text)
+
+    def make_batches(self, texts: List[str]) -> List[range]:
+        """Découpe les textes en lots d'au plus batch_tokens tokens et batch_max_docs documents"""
+        batches = []
+        start = 0
+        tokens = 0
+        for i, text in enumerate(texts):
+            count = self.count_tokens(text)
+            if i > start and (tokens + count > self.batch_tokens or i - start >= self.batch_max_docs):
+                batches.append(range(start, i))
+                start = i
+                tokens = 0
+            tokens += count
+        if start < len(texts):
+            batches.append(range(start, len(texts)))
+        return batches
+
+    def is_rate_limit(self, error: Exception) -> bool:
+        return getattr(error, 'status_code', None) == 429 or type(error).__name__ == 'RateLimitError'
+
+    def retry_after(self, error: Exception) -> Optional[float]:
+        """Délai d'attente indiqué par les en-têtes de limitation de débit du fournisseur"""
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            try:
+                return float(headers['retry-after'])
+            except ValueError:
+                pass
+        # Format OpenAI : "1s", "6m0s", "20ms"
+        delays = []
+        for header in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens'):
+            matches = DURATION_RE.findall(headers.get(header, ''))
+            if matches:
+                delays.append(sum(float(value) * DURATION_UNITS[unit] for value, unit in matches))
+        return max(delays) if delays else None
+
+    async def embed_batch(self, texts: List[str], limiter: AdaptiveLimiter) -> List[List[float]]:
+        """Vectorise un lot en respectant la limite de concurrence, avec backoff sur les 429"""
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            async with limiter:
+                try:
+                    with timed('embed_documents'):
+                        vectors = await self.embeddings.aembed_documents(texts)
+                    limiter.on_success()
+                    return vectors
+                except Exception as e:
+                    if not self.is_rate_limit(e) or attempt == self.max_retries:
+                        raise
+                    limiter.on_rate_limit()
+                    wait = self.retry_after(e) or delay
+
+            logger.warning(f"Embedding rate limited, retrying in {wait:.1f}s "
+                           f"(concurrency now {limiter.limit})")
+            await asyncio.sleep(wait + random.uniform(0, wait / 4))
+            delay = min(delay * 2, 60)
+
+    async def embed_and_store(self, texts: List[str], metadatas: List[dict], ids: List[str],
+                              store: Callable[[List[str], List[dict], List[str], List[List[float]]], None]) -> int:
+        """Vectorise tous les textes et appelle store(textes, métadonnées, ids, vecteurs) pour chaque lot"""
+        limiter = AdaptiveLimiter(self.concurrency)
+        store_lock = asyncio.Lock()
+
+        async def run(batch: range):
+            batch_texts = texts[batch.start:batch.stop]
+            vectors = await self.embed_batch(batch_texts, limiter)
+            # Un seul enregistrement à la fois, hors de la limite : les embeddings continuent
+            async with store_lock:
+                with timed('vector_upsert'):
+                    await asyncio.to_thread(
+                        store, batch_texts, metadatas[batch.start:batch.stop], ids[batch.start:batch.stop], vectors
+                    )
+
+        batches = self.make_batches(texts)
+        await asyncio.gather(*(run(batch) for batch in batches))
+        return len(batches)
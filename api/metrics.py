@@ -0,0 +1,95 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Des appels au cache en mémoire (~1 ms) aux réponses complètes du LLM (~30 s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    'email_api_stage_seconds',
+    "Durée des étapes de la recherche (embed_query, vector_query, llm...) et de l'indexation",
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+SEARCH_SECONDS = Histogram(
+    'email_api_search_seconds',
+    "Durée totale des recherches, par endpoint",
+    ['endpoint'],
+    buckets=LATENCY_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    'email_api_cache_requests_total',
+    "Consultations des caches (query_embedding, answer, embedding), par résultat",
+    ['cache', 'result']
+)
+
+class SearchTrace:
+    """Détail des étapes d'une recherche, renvoyé au client qui le demande"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.cache: Dict[str, Dict[str, int]] = {}
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()},
+            "cache": self.cache
+        }
+
+# Trace de la requête en cours ; les tâches et threads lancés par la requête en héritent
+current_trace: ContextVar[Optional[SearchTrace]] = ContextVar('current_trace', default=None)
+
+def start_trace() -> SearchTrace:
+    """Active la trace pour la requête en cours"""
+    trace = SearchTrace()
+    current_trace.set(trace)
+    return trace
+
+def observe_stage(stage: str, seconds: float):
+    """Enregistre la durée d'une étape dans l'histogramme et dans la trace éventuelle"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.stages[stage] = trace.stages.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage: str):
+    """Chronomètre le bloc comme une étape (y compris s'il lève une exception)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+def count_cache(cache: str, hits: int = 0, misses: int = 0):
+    """Compte les succès et échecs d'un cache"""
+    if hits:
+        CACHE_REQUESTS.labels(cache, 'hit').inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, 'miss').inc(misses)
+    trace = current_trace.get()
+    if trace is not None:
+        counters = trace.cache.setdefault(cache, {"hits": 0, "misses": 0})
+        counters["hits"] += hits
+        counters["misses"] += misses
+
+def export() -> Tuple[bytes, str]:
+    """
+    Métriques au format texte Prometheus, et leur type de contenu
+
+    Avec plusieurs workers, PROMETHEUS_MULTIPROC_DIR doit désigner un répertoire
+    commun (vidé au démarrage) : les métriques de tous les workers sont agrégées.
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
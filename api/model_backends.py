@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import httpx
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+OUTPUT_TOKEN_RE = re.compile(r'\S+\s*')
+
+def create_embeddings(http_client: httpx.AsyncClient) -> Embeddings:
+    """Modèle d'embedding selon EMBEDDING_BACKEND : openai ou hashing (hors ligne)"""
+    backend = os.getenv('EMBEDDING_BACKEND', 'openai')
+    if backend == 'openai':
+        return OpenAIEmbeddings(http_async_client=http_client)
+    if backend == 'hashing':
+        return HashingEmbeddings(
+            dimensions=int(os.getenv('EMBEDDING_DIMENSIONS', '384')),
+            latency=float(os.getenv('EMBEDDING_LATENCY_MS', '0')) / 1000
+        )
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+
+def create_chat_model(http_client: httpx.AsyncClient) -> BaseChatModel:
+    """Modèle de chat selon LLM_BACKEND : openai ou echo (hors ligne)"""
+    backend = os.getenv('LLM_BACKEND', 'openai')
+    if backend == 'openai':
+        return ChatOpenAI(model=os.getenv('LLM_MODEL', 'gpt-4o-mini'), http_async_client=http_client)
+    if backend == 'echo':
+        return EchoChatModel(
+            first_token_latency=float(os.getenv('LLM_LATENCY_MS', '0')) / 1000,
+            token_latency=float(os.getenv('LLM_TOKEN_LATENCY_MS', '0')) / 1000
+        )
+    raise ValueError(f"Unknown LLM_BACKEND: {backend}")
+
+class HashingEmbeddings(Embeddings):
+    """Embeddings déterministes hors ligne, par hachage des mots et bigrammes
+
+    Deux textes partageant des mots ont des vecteurs proches : la recherche reste
+    significative pour les tests de charge, sans réseau ni coût. latency simule
+    le temps de réponse du fournisseur, par appel.
+    """
+
+    def __init__(self, dimensions: int = 384, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.model = f"hashing-{dimensions}"
+
+    def embed_text(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        words = TOKEN_RE.findall(text.casefold())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], 'little') % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.embed_text(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self.embed_text(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+class EchoChatModel(BaseChatModel):
+    """Modèle de chat hors ligne : répond un gabarit décrivant le prompt reçu
+
+    first_token_latency simule le délai avant le premier token et token_latency
+    le délai entre deux tokens, en flux comme en réponse complète.
+    """
+
+    template: str = "Réponse simulée : {prompt_words} mots de prompt, dont {context_emails} emails de contexte."
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "echo"
+
+    def render(self, messages: List[BaseMessage]) -> List[str]:
+        """Tokens de la réponse (mots suivis de leurs espaces)"""
+        prompt = "\n".join(str(message.content) for message in messages)
+        answer = self.template.format(
+            prompt_words=len(prompt.split()),
+            context_emails=prompt.count("De: ")
+        )
+        return OUTPUT_TOKEN_RE.findall(answer)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self.render(messages)
+        time.sleep(self.first_token_latency + self.token_latency * max(len(tokens) - 1, 0))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tokens = self.render(messages)
+        await asyncio.sleep(self.first_token_latency + self.token_latency * max(len(tokens) - 1, 0))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for i, token in enumerate(self.render(messages)):
+            time.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for i, token in enumerate(self.render(messages)):
+            await asyncio.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
@@ -0,0 +1,64 @@
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from metrics import count_cache
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+def normalize_question(question: str) -> str:
+    """Forme canonique d'une question : casse, espaces et ponctuation finale ignorés"""
+    question = unicodedata.normalize('NFKC', question).casefold()
+    return WHITESPACE_RE.sub(' ', question).strip().rstrip(' ?!.')
+
+class TTLCache:
+    """Cache LRU en mémoire, borné en nombre d'entrées, avec expiration optionnelle
+
+    Utilisé depuis la boucle d'événements du serveur uniquement : pas de verrou.
+    Les succès et échecs d'un cache nommé sont aussi exportés en métriques.
+    """
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = None, name: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if self.name:
+                    count_cache(self.name, hits=1)
+                return value
+            del self._entries[key]
+        self.misses += 1
+        if self.name:
+            count_cache(self.name, misses=1)
+        return None
+
+    def set(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses
+        }
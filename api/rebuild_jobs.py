@@ -0,0 +1,162 @@
+import logging
+from datetime import datetime
+from typing import Callable, Optional
+
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+class RebuildJobStore:
+    """Alias de collection active et suivi des reconstructions de l'index, dans PostgreSQL
+
+    L'état est partagé entre les workers du serveur : un seul rebuild peut être
+    en cours, et chaque worker suit l'alias pour basculer sur la nouvelle collection.
+    """
+
+    # Un job sans nouvelle progression depuis ce délai est considéré comme abandonné
+    STALE_AFTER_SECONDS = 900
+
+    def __init__(self, connection: Callable):
+        self.connection = connection
+        self._schema_ready = False
+
+    def _execute(self, callback):
+        """Exécute callback(cursor) dans une transaction, sur une connexion empruntée au pool"""
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    if not self._schema_ready:
+                        cursor.execute("""
+                            CREATE TABLE IF NOT EXISTS vector_store_alias (
+                                alias TEXT PRIMARY KEY,
+                                collection TEXT NOT NULL,
+                                updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                            );
+
+                            CREATE TABLE IF NOT EXISTS vector_rebuild_jobs (
+                                id SERIAL PRIMARY KEY,
+                                collection TEXT NOT NULL,
+                                state TEXT NOT NULL DEFAULT 'running',
+                                total INTEGER,
+                                indexed INTEGER NOT NULL DEFAULT 0,
+                                error TEXT,
+                                started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                                updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                                finished_at TIMESTAMP
+                            );
+
+                            -- Au plus un job en cours
+                            CREATE UNIQUE INDEX IF NOT EXISTS idx_vector_rebuild_jobs_running
+                                ON vector_rebuild_jobs ((state)) WHERE state = 'running';
+                        """)
+                        self._schema_ready = True
+                    return callback(cursor)
+
+    def get_active_collection(self, alias: str) -> Optional[str]:
+        """Nom de la collection désignée par l'alias, ou None s'il n'a jamais été défini"""
+        def query(cursor):
+            cursor.execute("SELECT collection FROM vector_store_alias WHERE alias = %s", (alias,))
+            row = cursor.fetchone()
+            return row['collection'] if row else None
+
+        return self._execute(query)
+
+    def swap_alias(self, alias: str, collection: str) -> Optional[str]:
+        """Fait pointer l'alias vers une nouvelle collection ; retourne l'ancienne"""
+        def swap(cursor):
+            cursor.execute("SELECT collection FROM vector_store_alias WHERE alias = %s FOR UPDATE", (alias,))
+            row = cursor.fetchone()
+            cursor.execute("""
+                INSERT INTO vector_store_alias (alias, collection)
+                VALUES (%s, %s)
+                ON CONFLICT (alias) DO UPDATE SET
+                    collection = EXCLUDED.collection,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (alias, collection))
+            return row['collection'] if row else None
+
+        return self._execute(swap)
+
+    def create_job(self, collection: str) -> Optional[dict]:
+        """Enregistre un nouveau job, ou retourne None si un autre est déjà en cours"""
+        def insert(cursor):
+            cursor.execute("""
+                UPDATE vector_rebuild_jobs
+                SET state = 'failed', error = 'abandoned', finished_at = CURRENT_TIMESTAMP
+                WHERE state = 'running' AND updated_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            """, (self.STALE_AFTER_SECONDS,))
+            cursor.execute("""
+                INSERT INTO vector_rebuild_jobs (collection)
+                VALUES (%s)
+                ON CONFLICT DO NOTHING
+                RETURNING *
+            """, (collection,))
+            return cursor.fetchone()
+
+        row = self._execute(insert)
+        return self.describe(row) if row else None
+
+    def update_progress(self, job_id: int, total: int, indexed: int):
+        def update(cursor):
+            cursor.execute("""
+                UPDATE vector_rebuild_jobs
+                SET total = %s, indexed = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (total, indexed, job_id))
+
+        self._execute(update)
+
+    def finish_job(self, job_id: int, error: Optional[str] = None):
+        def update(cursor):
+            cursor.execute("""
+                UPDATE vector_rebuild_jobs
+                SET state = %s, error = %s, updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, ('failed' if error else 'succeeded', error, job_id))
+
+        self._execute(update)
+
+    def get_job(self, job_id: Optional[int] = None) -> Optional[dict]:
+        """État d'un job (le plus récent si job_id est None)"""
+        def query(cursor):
+            if job_id is None:
+                cursor.execute("SELECT * FROM vector_rebuild_jobs ORDER BY id DESC LIMIT 1")
+            else:
+                cursor.execute("SELECT * FROM vector_rebuild_jobs WHERE id = %s", (job_id,))
+            return cursor.fetchone()
+
+        row = self._execute(query)
+        return self.describe(row) if row else None
+
+    def get_running_job(self) -> Optional[dict]:
+        def query(cursor):
+            cursor.execute("SELECT * FROM vector_rebuild_jobs WHERE state = 'running'")
+            return cursor.fetchone()
+
+        row = self._execute(query)
+        return self.describe(row) if row else None
+
+    def describe(self, row: dict) -> dict:
+        """Représentation d'un job avec progression, débit et temps restant estimé"""
+        end = row['finished_at'] or datetime.now()
+        elapsed = max((end - row['started_at']).total_seconds(), 0.001)
+        total = row['total']
+        indexed = row['indexed']
+        throughput = indexed / elapsed
+        eta = None
+        if row['state'] == 'running' and total is not None and throughput > 0:
+            eta = round((total - indexed) / throughput, 1)
+
+        return {
+            "id": row['id'],
+            "state": row['state'],
+            "collection": row['collection'],
+            "total": total,
+            "indexed": indexed,
+            "progress": round(indexed / total, 4) if total else (1.0 if row['state'] == 'succeeded' else 0.0),
+            "throughput": round(throughput, 2),
+            "eta_seconds": eta,
+            "started_at": row['started_at'].isoformat(),
+            "finished_at": row['finished_at'].isoformat() if row['finished_at'] else None,
+            "error": row['error']
+        }
@@ -21,6 +21,24 @@ class ChatInterface {
     }
 
     addMessage(content, isUser = false) {
+        const bubble = this.createBubble(isUser);
+
+        if (isUser) {
+            // Si c'est un message utilisateur, c'est toujours du texte simple
+            bubble.textContent = content;
+        } else if (typeof content === 'object' && content.answer) {
+            // Si c'est une réponse de l'API
+            this.renderEmailResult(bubble, content);
+        } else {
+            // Pour les autres messages (comme les erreurs)
+            bubble.textContent = content;
+        }
+
+        this.scrollToBottom();
+        return bubble;
+    }
+
+    createBubble(isUser = false) {
         const messageDiv = document.createElement('div');
         messageDiv.className = 'flex items-start space-x-4';
 
@@ -50,31 +68,28 @@ class ChatInterface {
         const bubble = document.createElement('div');
         bubble.className = `${isUser ? 'bg-blue-500 text-white' : 'bg-gray-100 text-gray-800'} rounded-lg p-4 max-w-3xl`;
 
-        if (isUser) {
-            // Si c'est un message utilisateur, c'est toujours du texte simple
-            bubble.textContent = content;
-        } else if (typeof content === 'object' && content.answer) {
-            // Si c'est une réponse de l'API
-            this.renderEmailResult(bubble, content);
-        } else {
-            // Pour les autres messages (comme les erreurs)
-            bubble.textContent = content;
-        }
-
         messageDiv.appendChild(avatar);
         messageDiv.appendChild(bubble);
         this.messagesContainer.appendChild(messageDiv);
-        this.scrollToBottom();
+        return bubble;
     }
 
     renderEmailResult(container, result) {
         // Réponse principale
-        const answerDiv = document.createElement('div');
-        answerDiv.className = 'bg-blue-50 p-4 rounded-lg mb-4';
+        const answerDiv = this.renderAnswer(container);
         answerDiv.textContent = result.answer;
+        this.renderEmails(container, result.relevant_emails);
+    }
+
+    renderAnswer(container) {
+        const answerDiv = document.createElement('div');
+        answerDiv.className = 'bg-blue-50 p-4 rounded-lg mb-4 whitespace-pre-wrap';
         container.appendChild(answerDiv);
+        return answerDiv;
+    }
 
-        if (result.relevant_emails && result.relevant_emails.length > 0) {
+    renderEmails(container, emails) {
+        if (emails && emails.length > 0) {
             // Titre des emails pertinents
             const emailsTitle = document.createElement('h3');
             emailsTitle.className = 'text-sm font-semibold text-gray-500 uppercase tracking-wider mb-4';
@@ -82,7 +97,7 @@ class ChatInterface {
             container.appendChild(emailsTitle);
 
             // Liste des emails
-            result.relevant_emails.forEach(email => {
+            emails.forEach(email => {
                 const emailDiv = document.createElement('div');
                 emailDiv.className = 'bg-white border border-gray-200 rounded-lg p-4 mb-4';
 
@@ -247,6 +262,38 @@ class ChatInterface {
     }
 
 
+    async readEventStream(response, onEvent) {
+        // Lit un flux text/event-stream et appelle onEvent(événement, données) pour chaque message
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let separator;
+            while ((separator = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, separator);
+                buffer = buffer.slice(separator + 2);
+
+                let event = 'message';
+                const dataLines = [];
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        dataLines.push(line.slice(5).trim());
+                    }
+                });
+                if (dataLines.length > 0) {
+                    onEvent(event, JSON.parse(dataLines.join('\n')));
+                }
+            }
+        }
+    }
+
     async handleSubmit(e) {
         e.preventDefault();
         const question = this.userInput.value.trim();
@@ -261,25 +308,47 @@ class ChatInterface {
         const loadingMessage = this.addLoadingMessage();
 
         try {
-            const response = await fetch(`${settings.getServerUrl()}/api/v1/search`, {
+            const response = await fetch(`${settings.getServerUrl()}/api/v1/search/stream`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
                 },
                 body: JSON.stringify({ question }),
             });
 
-            const result = await response.json();
-
-            // Supprimer l'animation de chargement
-            this.removeLoadingMessage();
-
-            if (result.status === 'error') {
+            if (!response.ok || !response.body) {
+                this.removeLoadingMessage();
                 this.addMessage('Désolé, une erreur est survenue. Veuillez réessayer.');
-            } else {
-                // Ajouter la réponse formatée
-                this.addMessage(result, false);
+                return;
             }
+
+            // La bulle de réponse est créée au premier événement reçu
+            let bubble = null;
+            let answerDiv = null;
+            const ensureBubble = () => {
+                if (!bubble) {
+                    this.removeLoadingMessage();
+                    bubble = this.createBubble(false);
+                    answerDiv = this.renderAnswer(bubble);
+                }
+            };
+
+            await this.readEventStream(response, (event, data) => {
+                if (event === 'emails') {
+                    ensureBubble();
+                    this.renderEmails(bubble, data.relevant_emails);
+                } else if (event === 'token') {
+                    ensureBubble();
+                    answerDiv.textContent += data.content;
+                } else if (event === 'error') {
+                    this.removeLoadingMessage();
+                    this.addMessage('Désolé, une erreur est survenue. Veuillez réessayer.');
+                }
+                this.scrollToBottom();
+            });
+
+            this.removeLoadingMessage();
         } catch (error) {
             console.error('An error occurred while fetching the data:', error);
             this.removeLoadingMessage();
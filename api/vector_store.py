@@ -0,0 +1,290 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings
+
+logger = logging.getLogger(__name__)
+
+def create_vector_client(backend: Optional[str] = None):
+    """
+    Client de base vectorielle selon VECTOR_BACKEND
+
+    - http : serveur Chroma (CHROMA_HOST / CHROMA_PORT)
+    - persistent : Chroma embarqué dans le processus, stocké dans VECTOR_STORE_PATH
+    - numpy : index en mémoire du processus, persisté en fichiers .npy mappés en mémoire
+
+    Les clients embarqués ne partagent pas leurs écritures entre processus : ils
+    sont destinés aux déploiements à un seul worker (refusés si WEB_CONCURRENCY > 1),
+    aux tests et aux benchmarks.
+    """
+    backend = backend or os.getenv('VECTOR_BACKEND', 'http')
+    path = os.getenv('VECTOR_STORE_PATH', '/data/vector_store')
+    if backend != 'http' and int(os.getenv('WEB_CONCURRENCY', '1')) > 1:
+        raise ValueError(f"VECTOR_BACKEND={backend} stores vectors in the worker process: "
+                         f"set WEB_CONCURRENCY=1 or use VECTOR_BACKEND=http")
+
+    if backend == 'http':
+        return chromadb.HttpClient(
+            host=os.getenv('CHROMA_HOST', 'chroma'),
+            port=os.getenv('CHROMA_PORT', '8000'),
+            settings=Settings(anonymized_telemetry=False)
+        )
+    if backend == 'persistent':
+        return chromadb.PersistentClient(path=path, settings=Settings(anonymized_telemetry=False))
+    if backend == 'numpy':
+        return NumpyVectorClient(path)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
+
+def matches_where(metadata: dict, where: Optional[dict]) -> bool:
+    """Évalue le sous-ensemble des clauses where de Chroma utilisé par l'API"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if value is None and operator not in ('$ne', '$nin'):
+                    return False
+                if operator == '$eq' and value != operand:
+                    return False
+                if operator == '$ne' and value == operand:
+                    return False
+                if operator == '$gt' and not value > operand:
+                    return False
+                if operator == '$gte' and not value >= operand:
+                    return False
+                if operator == '$lt' and not value < operand:
+                    return False
+                if operator == '$lte' and not value <= operand:
+                    return False
+                if operator == '$in' and value not in operand:
+                    return False
+                if operator == '$nin' and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+class NumpyCollection:
+    """Collection compatible avec l'API des collections Chroma, en similarité cosinus exacte
+
+    Les écritures restent en mémoire et sont persistées par modify(), appelé en fin
+    de synchronisation : un arrêt en cours de synchronisation laisse la version
+    précédente sur disque, et la synchronisation suivante reprend l'écart.
+    """
+
+    def __init__(self, name: str, path: str, metadata: Optional[dict] = None):
+        self.name = name
+        self.path = path
+        self.metadata = metadata
+        self.ids: List[str] = []
+        self.documents: List[Optional[str]] = []
+        self.metadatas: List[Optional[dict]] = []
+        self.positions: Dict[str, int] = {}
+        self.vectors: List[np.ndarray] = []
+        self._matrix = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, name: str, path: str) -> 'NumpyCollection':
+        with open(os.path.join(path, 'collection.json')) as f:
+            collection = cls(name, path, json.load(f).get('metadata'))
+        records_path = os.path.join(path, 'records.json')
+        if os.path.exists(records_path):
+            with open(records_path) as f:
+                records = json.load(f)
+            collection.ids = records['ids']
+            collection.documents = records['documents']
+            collection.metadatas = records['metadatas']
+            collection.positions = {doc_id: i for i, doc_id in enumerate(collection.ids)}
+            # Vecteurs mappés en mémoire : seules les pages lues sont chargées
+            matrix = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+            collection.vectors = list(matrix)
+            collection._matrix = matrix
+        return collection
+
+    def persist(self):
+        """Écrit la collection sur disque (fichiers remplacés atomiquement)"""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            matrix = self.matrix()
+            self._write(os.path.join(self.path, 'vectors.npy'), lambda f: np.save(f, matrix))
+            self._write(os.path.join(self.path, 'records.json'), lambda f: f.write(json.dumps({
+                "ids": self.ids,
+                "documents": self.documents,
+                "metadatas": self.metadatas
+            }).encode()))
+            self._write(os.path.join(self.path, 'collection.json'),
+                        lambda f: f.write(json.dumps({"metadata": self.metadata}).encode()))
+
+    def _write(self, path: str, write):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def matrix(self) -> np.ndarray:
+        """Matrice (n, d) des vecteurs normalisés, reconstruite après une écriture"""
+        if self._matrix is None:
+            self._matrix = np.vstack(self.vectors) if self.vectors else np.zeros((0, 0), dtype=np.float32)
+        return self._matrix
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: Optional[List[str]] = None,
+               metadatas: Optional[List[dict]] = None):
+        with self._lock:
+            for i, doc_id in enumerate(ids):
+                vector = np.asarray(embeddings[i], dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                vector = vector / norm if norm else vector
+                document = documents[i] if documents else None
+                metadata = metadatas[i] if metadatas else None
+                position = self.positions.get(doc_id)
+                if position is None:
+                    self.positions[doc_id] = len(self.ids)
+                    self.ids.append(doc_id)
+                    self.vectors.append(vector)
+                    self.documents.append(document)
+                    self.metadatas.append(metadata)
+                else:
+                    self.vectors[position] = vector
+                    self.documents[position] = document
+                    self.metadatas[position] = metadata
+            self._matrix = None
+
+    add = upsert
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None):
+        with self._lock:
+            removed = set(ids or [])
+            if where:
+                removed.update(doc_id for doc_id, metadata in zip(self.ids, self.metadatas)
+                               if matches_where(metadata or {}, where))
+            keep = [i for i, doc_id in enumerate(self.ids) if doc_id not in removed]
+            if len(keep) == len(self.ids):
+                return
+            self.ids = [self.ids[i] for i in keep]
+            self.vectors = [self.vectors[i] for i in keep]
+            self.documents = [self.documents[i] for i in keep]
+            self.metadatas = [self.metadatas[i] for i in keep]
+            self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+            self._matrix = None
+
+    def modify(self, name: Optional[str] = None, metadata: Optional[dict] = None):
+        with self._lock:
+            if metadata is not None:
+                self.metadata = metadata
+            self.persist()
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Optional[List[str]] = None) -> dict:
+        include = include or ["metadatas", "documents"]
+        with self._lock:
+            if ids is not None:
+                positions = [self.positions[doc_id] for doc_id in ids if doc_id in self.positions]
+            else:
+                positions = range(len(self.ids))
+            positions = [i for i in positions if matches_where(self.metadatas[i] or {}, where)]
+            start = offset or 0
+            positions = positions[start:start + limit if limit is not None else None]
+            return {
+                "ids": [self.ids[i] for i in positions],
+                "documents": [self.documents[i] for i in positions] if "documents" in include else None,
+                "metadatas": [self.metadatas[i] for i in positions] if "metadatas" in include else None
+            }
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> dict:
+        include = include or ["metadatas", "documents", "distances"]
+        with self._lock:
+            matrix = self.matrix()
+            candidates = None
+            if where:
+                candidates = np.array([i for i, metadata in enumerate(self.metadatas)
+                                       if matches_where(metadata or {}, where)], dtype=np.int64)
+            results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            for embedding in query_embeddings:
+                query = np.asarray(embedding, dtype=np.float32)
+                norm = np.linalg.norm(query)
+                query = query / norm if norm else query
+                rows = candidates if candidates is not None else np.arange(len(self.ids))
+                if len(rows):
+                    distances = 1.0 - matrix[rows] @ query
+                    k = min(n_results, len(rows))
+                    top = np.argpartition(distances, k - 1)[:k]
+                    top = top[np.argsort(distances[top])]
+                    positions, distances = rows[top], distances[top]
+                else:
+                    positions, distances = [], []
+                results["ids"].append([self.ids[i] for i in positions])
+                results["documents"].append([self.documents[i] for i in positions])
+                results["metadatas"].append([self.metadatas[i] for i in positions])
+                results["distances"].append([float(d) for d in distances])
+            for field in ("documents", "metadatas", "distances"):
+                if field not in include:
+                    results[field] = None
+            return results
+
+class NumpyVectorClient:
+    """Client embarqué exposant le sous-ensemble de l'API client de Chroma utilisé par l'analyseur"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.collections: Dict[str, NumpyCollection] = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _collection_path(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def list_collections(self) -> List[str]:
+        """Noms des collections (comme Chroma >= 0.6), sans les charger"""
+        with self._lock:
+            names = set(self.collections)
+            names.update(name for name in os.listdir(self.path)
+                         if os.path.exists(os.path.join(self._collection_path(name), 'collection.json')))
+        return sorted(names)
+
+    def get_collection(self, name: str) -> NumpyCollection:
+        with self._lock:
+            if name not in self.collections:
+                path = self._collection_path(name)
+                if not os.path.exists(os.path.join(path, 'collection.json')):
+                    raise ValueError(f"Collection {name} does not exist.")
+                self.collections[name] = NumpyCollection.load(name, path)
+            return self.collections[name]
+
+    def create_collection(self, name: str, metadata: Optional[dict] = None) -> NumpyCollection:
+        with self._lock:
+            path = self._collection_path(name)
+            if name in self.collections or os.path.exists(path):
+                raise ValueError(f"Collection {name} already exists.")
+            collection = NumpyCollection(name, path, metadata)
+            collection.persist()
+            self.collections[name] = collection
+            return collection
+
+    def get_or_create_collection(self, name: str, metadata: Optional[dict] = None) -> NumpyCollection:
+        try:
+            return self.get_collection(name)
+        except ValueError:
+            return self.create_collection(name, metadata)
+
+    def delete_collection(self, name: str):
+        with self._lock:
+            self.collections.pop(name, None)
+            shutil.rmtree(self._collection_path(name), ignore_errors=True)
@@ -0,0 +1,278 @@
+"""Serveur IMAP minimal en mémoire, pour les benchmarks du fetcher
+
+Il implémente le sous-ensemble d'IMAP4rev1 utilisé par email_fetcher.py
+(CAPABILITY, LOGIN, LIST, SELECT, STATUS, UID SEARCH, UID FETCH, IDLE...), en
+clair sur 127.0.0.1. Chaque réponse peut être retardée pour simuler la latence
+réseau d'un vrai serveur, et les allers-retours et octets envoyés sont comptés.
+"""
+import re
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+COMMAND_RE = re.compile(rb'^(\S+) (?:(UID) )?(\S+)(?: (.*))?$', re.IGNORECASE)
+HEADER_FIELDS_RE = re.compile(r'BODY\.PEEK\[HEADER\.FIELDS \(([^)]*)\)\]', re.IGNORECASE)
+PARTIAL_TEXT_RE = re.compile(r'BODY\.PEEK\[TEXT\](?:<(\d+)\.(\d+)>)?', re.IGNORECASE)
+SEARCH_UID_RE = re.compile(r'UID (\S+)', re.IGNORECASE)
+
+def to_crlf(message: bytes) -> bytes:
+    """Normalise les fins de ligne en CRLF, comme sur un vrai serveur"""
+    return message.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+
+def parse_sequence_set(sequence_set: str, max_value: int) -> List[Tuple[int, int]]:
+    """Plages (début, fin) d'un ensemble IMAP tel que 1:5,7,9:*"""
+    ranges = []
+    for part in sequence_set.split(','):
+        bounds = [max_value if bound == '*' else int(bound) for bound in part.split(':')]
+        ranges.append((min(bounds), max(bounds)))
+    return ranges
+
+class StoredMessage:
+    def __init__(self, uid: int, raw: bytes):
+        self.uid = uid
+        self.raw = to_crlf(raw)
+        separator = self.raw.find(b'\r\n\r\n')
+        self.header = self.raw[:separator + 2] if separator >= 0 else self.raw
+        self.text = self.raw[separator + 4:] if separator >= 0 else b''
+
+    def header_fields(self, names: List[str]) -> bytes:
+        """En-têtes demandés (lignes de continuation comprises), suivis d'une ligne vide"""
+        wanted = {name.upper() for name in names}
+        selected = []
+        keep = False
+        for line in self.header.split(b'\r\n'):
+            if not line:
+                continue
+            if line[:1] in (b' ', b'\t'):
+                if keep:
+                    selected.append(line)
+                continue
+            keep = line.split(b':', 1)[0].strip().decode(errors='ignore').upper() in wanted
+            if keep:
+                selected.append(line)
+        return b'\r\n'.join(selected) + b'\r\n\r\n'
+
+class Mailbox:
+    def __init__(self, name: str, messages: List[bytes], uidvalidity: int):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.messages = [StoredMessage(uid, raw) for uid, raw in enumerate(messages, start=1)]
+
+    @property
+    def uidnext(self) -> int:
+        return (self.messages[-1].uid if self.messages else 0) + 1
+
+    def append(self, raw: bytes) -> int:
+        """Ajoute un message (nouvel email reçu) et retourne son UID"""
+        message = StoredMessage(self.uidnext, raw)
+        self.messages.append(message)
+        return message.uid
+
+    def by_uid(self, sequence_set: str) -> List[Tuple[int, StoredMessage]]:
+        """Messages (numéro de séquence, message) correspondant à un ensemble d'UIDs"""
+        ranges = parse_sequence_set(sequence_set, self.uidnext - 1)
+        return [(seq, message) for seq, message in enumerate(self.messages, start=1)
+                if any(start <= message.uid <= end for start, end in ranges)]
+
+class BenchmarkStats:
+    """Compteurs du serveur, remis à zéro entre deux cycles"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.commands: Dict[str, int] = {}
+            self.bytes_sent = 0
+            self.connections = 0
+
+    def count(self, command: str):
+        with self._lock:
+            self.commands[command] = self.commands.get(command, 0) + 1
+
+    def sent(self, nbytes: int):
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "round_trips": sum(self.commands.values()),
+                "commands": dict(self.commands),
+                "bytes_sent": self.bytes_sent,
+                "connections": self.connections
+            }
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    server: 'BenchmarkIMAPServer'
+
+    def setup(self):
+        super().setup()
+        self.selected: Optional[Mailbox] = None
+        with self.server.stats._lock:
+            self.server.stats.connections += 1
+
+    def send(self, data: bytes):
+        self.wfile.write(data)
+        self.server.stats.sent(len(data))
+
+    def line(self, text: str):
+        self.send(text.encode() + b'\r\n')
+
+    def handle(self):
+        self.line(f"* OK [CAPABILITY {self.server.capabilities}] Benchmark IMAP ready")
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            match = COMMAND_RE.match(raw.rstrip(b'\r\n'))
+            if not match:
+                self.line("* BAD Invalid command")
+                continue
+            tag = match.group(1).decode()
+            uid = bool(match.group(2))
+            command = match.group(3).decode().upper()
+            args = (match.group(4) or b'').decode(errors='replace')
+            self.server.stats.count(f"UID {command}" if uid else command)
+
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            handler = getattr(self, f"do_{command}", None)
+            if handler is None:
+                self.line(f"{tag} BAD Unknown command {command}")
+                continue
+            try:
+                if handler(tag, args, uid) is False:
+                    return
+            except (ValueError, IndexError) as e:
+                self.line(f"{tag} BAD {e}")
+            self.wfile.flush()
+
+    def do_CAPABILITY(self, tag, args, uid):
+        self.line(f"* CAPABILITY {self.server.capabilities}")
+        self.line(f"{tag} OK CAPABILITY completed")
+
+    def do_LOGIN(self, tag, args, uid):
+        self.line(f"{tag} OK LOGIN completed")
+
+    def do_NOOP(self, tag, args, uid):
+        self.line(f"{tag} OK NOOP completed")
+
+    def do_ENABLE(self, tag, args, uid):
+        self.line(f"{tag} OK ENABLE completed")
+
+    def do_LOGOUT(self, tag, args, uid):
+        self.line("* BYE Logging out")
+        self.line(f"{tag} OK LOGOUT completed")
+        self.wfile.flush()
+        return False
+
+    def do_CLOSE(self, tag, args, uid):
+        self.selected = None
+        self.line(f"{tag} OK CLOSE completed")
+
+    def do_LIST(self, tag, args, uid):
+        for name in self.server.mailboxes:
+            self.line(f'* LIST (\\HasNoChildren) "/" "{name}"')
+        self.line(f"{tag} OK LIST completed")
+
+    def mailbox(self, args: str) -> Mailbox:
+        name = args.strip().split(' (')[0].strip('"')
+        if name not in self.server.mailboxes:
+            raise ValueError(f"No such mailbox {name}")
+        return self.server.mailboxes[name]
+
+    def do_SELECT(self, tag, args, uid):
+        mailbox = self.mailbox(args)
+        self.selected = mailbox
+        self.line(f"* {len(mailbox.messages)} EXISTS")
+        self.line("* 0 RECENT")
+        self.line("* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)")
+        self.line(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid")
+        self.line(f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID")
+        self.line(f"{tag} OK [READ-WRITE] SELECT completed")
+
+    do_EXAMINE = do_SELECT
+
+    def do_STATUS(self, tag, args, uid):
+        mailbox = self.mailbox(args)
+        self.line(f'* STATUS "{mailbox.name}" (MESSAGES {len(mailbox.messages)} UIDNEXT {mailbox.uidnext} '
+                  f'UIDVALIDITY {mailbox.uidvalidity})')
+        self.line(f"{tag} OK STATUS completed")
+
+    def do_SEARCH(self, tag, args, uid):
+        if self.selected is None:
+            raise ValueError("No mailbox selected")
+        match = SEARCH_UID_RE.search(args)
+        messages = self.selected.by_uid(match.group(1)) if match else list(enumerate(self.selected.messages, 1))
+        results = [str(message.uid) if uid else str(seq) for seq, message in messages]
+        self.line("* SEARCH" + "".join(f" {result}" for result in results))
+        self.line(f"{tag} OK SEARCH completed")
+
+    def do_FETCH(self, tag, args, uid):
+        if self.selected is None:
+            raise ValueError("No mailbox selected")
+        sequence_set, items = args.split(' ', 1)
+        items_upper = items.upper()
+        header_match = HEADER_FIELDS_RE.search(items)
+        text_match = PARTIAL_TEXT_RE.search(items)
+
+        if uid:
+            messages = self.selected.by_uid(sequence_set)
+        else:
+            ranges = parse_sequence_set(sequence_set, len(self.selected.messages))
+            messages = [(seq, message) for seq, message in enumerate(self.selected.messages, 1)
+                        if any(start <= seq <= end for start, end in ranges)]
+
+        for seq, message in messages:
+            parts = [f"UID {message.uid}".encode()]
+            if 'RFC822.SIZE' in items_upper:
+                parts.append(f"RFC822.SIZE {len(message.raw)}".encode())
+            if header_match:
+                header = message.header_fields(header_match.group(1).split())
+                parts.append(f"BODY[HEADER.FIELDS ({header_match.group(1)})] {{{len(header)}}}\r\n".encode() + header)
+            if text_match:
+                text = message.text
+                name = "BODY[TEXT]"
+                if text_match.group(1) is not None:
+                    start, length = int(text_match.group(1)), int(text_match.group(2))
+                    text = text[start:start + length]
+                    name = f"BODY[TEXT]<{start}>"
+                parts.append(f"{name} {{{len(text)}}}\r\n".encode() + text)
+            if 'BODY.PEEK[]' in items_upper or 'RFC822 ' in items_upper + ' ':
+                parts.append(f"BODY[] {{{len(message.raw)}}}\r\n".encode() + message.raw)
+            self.send(f"* {seq} FETCH (".encode() + b" ".join(parts) + b")\r\n")
+        self.line(f"{tag} OK FETCH completed")
+
+    def do_IDLE(self, tag, args, uid):
+        self.line("+ idling")
+        self.wfile.flush()
+        while True:
+            line = self.rfile.readline()
+            if not line or line.strip().upper() == b'DONE':
+                break
+        self.line(f"{tag} OK IDLE terminated")
+
+class BenchmarkIMAPServer(socketserver.ThreadingTCPServer):
+    """Serveur IMAP de benchmark ; port 0 choisit un port libre (voir server_address)"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailboxes: Dict[str, List[bytes]], host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, capabilities: str = 'IMAP4rev1 IDLE UIDPLUS'):
+        super().__init__((host, port), IMAPHandler)
+        self.mailboxes = {
+            name: Mailbox(name, messages, uidvalidity=1000 + index)
+            for index, (name, messages) in enumerate(mailboxes.items())
+        }
+        self.latency = latency
+        self.capabilities = capabilities
+        self.stats = BenchmarkStats()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name="imap-server", daemon=True)
+        thread.start()
+        return thread
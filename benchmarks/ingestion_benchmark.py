@@ -0,0 +1,289 @@
+"""Benchmark d'ingestion du fetcher
+
+Génère des boîtes mail synthétiques, les sert depuis un serveur IMAP local et
+lance le cycle de synchronisation réel (email_fetcher.py) contre une base
+PostgreSQL de test : un cycle à froid (tables vidées), puis des cycles à chaud
+(avec éventuellement de nouveaux messages arrivés entre deux cycles).
+
+Chaque cycle s'exécute dans un processus séparé, pour que le pic de mémoire
+mesuré soit celui du cycle. Exemple :
+
+    DB_HOST=localhost python benchmarks/ingestion_benchmark.py --messages 5000 --output ingestion.json
+
+ATTENTION : les tables emails, email_locations et mailbox_sync_state de la base
+ciblée sont vidées au début du benchmark.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import psycopg2
+import psycopg2.extensions
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'email-fetcher'))
+
+from imap_server import BenchmarkIMAPServer
+from synthetic_mail import MailboxSpec, generate_mailboxes
+
+BENCHMARK_TABLES = ('emails', 'email_locations', 'mailbox_sync_state')
+
+# Temps passé dans PostgreSQL par le processus du cycle en cours
+DB_TIMINGS = {'statements': 0, 'execute': 0.0, 'commits': 0, 'commit': 0.0}
+DB_TIMINGS_LOCK = threading.Lock()
+
+def record_db_time(key: str, counter: str, elapsed: float):
+    with DB_TIMINGS_LOCK:
+        DB_TIMINGS[key] += elapsed
+        DB_TIMINGS[counter] += 1
+
+_timed_cursor_classes = {}
+
+def timed_cursor_class(base):
+    """Sous-classe du curseur demandé dont chaque requête est chronométrée"""
+    if base not in _timed_cursor_classes:
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return base.execute(self, query, vars)
+            finally:
+                record_db_time('execute', 'statements', time.perf_counter() - started)
+
+        def executemany(self, query, vars_list):
+            started = time.perf_counter()
+            try:
+                return base.executemany(self, query, vars_list)
+            finally:
+                record_db_time('execute', 'statements', time.perf_counter() - started)
+
+        _timed_cursor_classes[base] = type(f"Timed{base.__name__}", (base,), {
+            'execute': execute,
+            'executemany': executemany
+        })
+    return _timed_cursor_classes[base]
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Connexion dont les requêtes (execute_values compris) et les commits sont chronométrés"""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_db_time('commit', 'commits', time.perf_counter() - started)
+
+def run_cycle(env: Dict[str, str], verbose: bool, results: multiprocessing.Queue):
+    """Exécute un cycle de synchronisation complet (processus enfant)"""
+    os.environ.update(env)
+    import email_fetcher
+
+    if not verbose:
+        logging.getLogger(email_fetcher.__name__).setLevel(logging.WARNING)
+
+    class TimedFetcher(email_fetcher.EmailFetcher):
+        def open_db_connection(self):
+            return psycopg2.connect(
+                host=self.config.DB_HOST,
+                port=self.config.DB_PORT,
+                dbname=self.config.DB_NAME,
+                user=self.config.DB_USER,
+                password=self.config.DB_PASSWORD,
+                connection_factory=TimedConnection
+            )
+
+    started = time.perf_counter()
+    stages = {}
+    error = None
+    try:
+        # Schéma créé au démarrage, comme dans main(), hors de la mesure
+        email_fetcher.init_database(email_fetcher.Config())
+        started = time.perf_counter()
+        fetcher = TimedFetcher()
+        stages = fetcher.stats.stages
+        fetcher.sync_all_mailboxes()
+    except Exception as e:
+        error = str(e)
+    duration = time.perf_counter() - started
+
+    # ru_maxrss est en Ko sous Linux ; RUSAGE_CHILDREN couvre les processus d'analyse MIME
+    results.put({
+        'duration': duration,
+        'error': error,
+        'db': dict(DB_TIMINGS),
+        'stages': stages,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_rss_children_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    })
+
+def db_settings() -> Dict[str, str]:
+    """Base PostgreSQL de test, lue dans les mêmes variables que le fetcher"""
+    return {
+        'DB_HOST': os.getenv('DB_HOST', 'localhost'),
+        'DB_PORT': os.getenv('DB_PORT', '5432'),
+        'DB_NAME': os.getenv('DB_NAME', 'emails'),
+        'DB_USER': os.getenv('DB_USER', 'postgres'),
+        'DB_PASSWORD': os.getenv('DB_PASSWORD', 'postgres')
+    }
+
+def db_connect():
+    settings = db_settings()
+    return psycopg2.connect(
+        host=settings['DB_HOST'],
+        port=int(settings['DB_PORT']),
+        dbname=settings['DB_NAME'],
+        user=settings['DB_USER'],
+        password=settings['DB_PASSWORD']
+    )
+
+def reset_tables():
+    """Vide les tables du fetcher (si elles existent) pour un cycle à froid"""
+    conn = db_connect()
+    try:
+        with conn.cursor() as cursor:
+            for table in BENCHMARK_TABLES:
+                cursor.execute("SELECT to_regclass(%s)", (table,))
+                if cursor.fetchone()[0] is not None:
+                    cursor.execute(f"TRUNCATE {table}")
+        conn.commit()
+    finally:
+        conn.close()
+
+def count_emails() -> int:
+    conn = db_connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM emails")
+            return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+def run_measured_cycle(name: str, server: BenchmarkIMAPServer, env: Dict[str, str], verbose: bool) -> dict:
+    """Lance un cycle dans un processus "spawn" et assemble ses mesures"""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    server.stats.reset()
+    process = context.Process(target=run_cycle, args=(env, verbose, results), name=f"cycle-{name}")
+    process.start()
+    result = results.get()
+    process.join()
+
+    imap = server.stats.snapshot()
+    duration = result['duration']
+    download = result['stages'].get('download', {'messages': 0, 'bytes': 0})
+    return {
+        'cycle': name,
+        'duration': duration,
+        'error': result['error'],
+        'messages': download['messages'],
+        'messages_per_second': download['messages'] / duration if duration else 0.0,
+        'bytes_per_second': imap['bytes_sent'] / duration if duration else 0.0,
+        'imap': imap,
+        'db': result['db'],
+        'stages': result['stages'],
+        'peak_rss_mb': result['peak_rss_mb'],
+        'peak_rss_children_mb': result['peak_rss_children_mb'],
+        'emails_in_db': count_emails()
+    }
+
+def print_report(cycles: List[dict]):
+    print(f"{'cycle':<8} {'msgs':>7} {'time s':>8} {'msg/s':>9} {'MB/s':>7} {'round-trips':>12} "
+          f"{'db s':>7} {'rss MB':>8} {'parse rss MB':>13}")
+    for cycle in cycles:
+        db_time = cycle['db']['execute'] + cycle['db']['commit']
+        print(f"{cycle['cycle']:<8} {cycle['messages']:>7} {cycle['duration']:>8.2f} "
+              f"{cycle['messages_per_second']:>9.1f} {cycle['bytes_per_second'] / 1e6:>7.2f} "
+              f"{cycle['imap']['round_trips']:>12} {db_time:>7.2f} {cycle['peak_rss_mb']:>8.1f} "
+              f"{cycle['peak_rss_children_mb']:>13.1f}")
+        for stage, counters in cycle['stages'].items():
+            print(f"    {stage:<9} busy {counters['busy']:.2f}s, blocked {counters['blocked']:.2f}s, "
+                  f"{counters['bytes'] / 1e6:.1f} MB")
+        if cycle['error']:
+            print(f"    error: {cycle['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark d'ingestion IMAP -> PostgreSQL du fetcher")
+    parser.add_argument('--messages', type=int, default=1000, help="messages par boîte mail")
+    parser.add_argument('--mailboxes', type=int, default=2, help="nombre de boîtes mail (INBOX, Dossier1...)")
+    parser.add_argument('--body-kb', type=float, default=4.0, help="taille moyenne du texte, en Ko")
+    parser.add_argument('--html-ratio', type=float, default=0.5)
+    parser.add_argument('--attachment-ratio', type=float, default=0.2)
+    parser.add_argument('--attachment-kb', type=float, default=200.0, help="taille moyenne d'une pièce jointe, en Ko")
+    parser.add_argument('--nested-ratio', type=float, default=0.1, help="part des messages à pièces jointes imbriqués")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1,
+                        help="part de INBOX copiée dans les autres boîtes (déduplication)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="latence simulée par commande IMAP")
+    parser.add_argument('--warm-cycles', type=int, default=2)
+    parser.add_argument('--new-messages', type=int, default=0,
+                        help="nouveaux messages par boîte mail avant chaque cycle à chaud")
+    parser.add_argument('--concurrency', type=int, help="IMAP_CONCURRENCY du fetcher")
+    parser.add_argument('--parse-workers', type=int, help="PARSE_WORKERS du fetcher")
+    parser.add_argument('--batch-size', type=int, help="BATCH_SIZE du fetcher")
+    parser.add_argument('--output', help="fichier JSON de résultats")
+    parser.add_argument('--verbose', action='store_true', help="affiche les logs du fetcher")
+    args = parser.parse_args()
+
+    names = ['INBOX'] + [f'Dossier{i}' for i in range(1, args.mailboxes)]
+    total = args.messages + args.new_messages * args.warm_cycles
+    spec = dict(messages=total, body_kb=args.body_kb, html_ratio=args.html_ratio,
+                attachment_ratio=args.attachment_ratio, attachment_kb=args.attachment_kb,
+                nested_ratio=args.nested_ratio, seed=args.seed)
+
+    started = time.perf_counter()
+    generated = generate_mailboxes({name: MailboxSpec(**spec) for name in names}, args.duplicate_ratio)
+    # Les messages au-delà de --messages arrivent entre les cycles à chaud
+    initial = {name: messages[:args.messages] + messages[total:] for name, messages in generated.items()}
+    arrivals = {name: messages[args.messages:total] for name, messages in generated.items()}
+    print(f"Generated {sum(len(m) for m in generated.values())} messages "
+          f"({sum(len(raw) for m in generated.values() for raw in m) / 1e6:.1f} MB) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    server = BenchmarkIMAPServer(initial, latency=args.latency_ms / 1000)
+    server.start()
+
+    env = {
+        'IMAP_SERVER': server.server_address[0],
+        'IMAP_PORT': str(server.server_address[1]),
+        'IMAP_SSL': 'false',
+        'EMAIL_ADDRESS': 'bench@bench.example',
+        'EMAIL_PASSWORD': 'bench',
+        **db_settings()
+    }
+    for option, variable in (('concurrency', 'IMAP_CONCURRENCY'), ('parse_workers', 'PARSE_WORKERS'),
+                             ('batch_size', 'BATCH_SIZE')):
+        if getattr(args, option) is not None:
+            env[variable] = str(getattr(args, option))
+
+    cycles = []
+    try:
+        reset_tables()
+        cycles.append(run_measured_cycle('cold', server, env, args.verbose))
+        for i in range(args.warm_cycles):
+            for name, messages in arrivals.items():
+                for raw in messages[i * args.new_messages:(i + 1) * args.new_messages]:
+                    server.mailboxes[name].append(raw)
+            cycles.append(run_measured_cycle(f'warm-{i + 1}', server, env, args.verbose))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print_report(cycles)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'parameters': vars(args), 'cycles': cycles}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Benchmark de l'indexation et de la recherche de l'API
+
+Charge N emails synthétiques dans PostgreSQL (avec le schéma du fetcher),
+construit l'index vectoriel avec setup_vector_store, puis envoie des recherches
+concurrentes à débit fixe (boucle ouverte) sur search_with_context ou sur
+l'endpoint POST /api/v1/search. Les fournisseurs sont simulés par défaut
+(EMBEDDING_BACKEND=hashing, LLM_BACKEND=echo, VECTOR_BACKEND=numpy) : seules les
+latences injectées et le code de l'API sont mesurés.
+
+Avec plusieurs tailles (--sizes 1000,10000), le corpus grandit d'une étape à
+l'autre et l'indexation mesurée est incrémentale. Exemple :
+
+    DB_HOST=localhost python benchmarks/retrieval_benchmark.py --sizes 1000,5000 --qps 20 --output retrieval.json
+
+ATTENTION : la table emails de la base ciblée est vidée au début du benchmark.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'email-fetcher'))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'api'))
+
+from metrics import start_trace
+from synthetic_mail import SENDERS, WORDS, body_text, paragraph
+
+# Étapes chronométrées par l'analyseur (voir api/metrics.py), puis durée totale
+STAGES = ('embed_query', 'vector_query', 'lexical_query', 'prompt_build', 'llm', 'total')
+
+QUESTION_TEMPLATES = (
+    "Quand ai-je reçu {a} {b} ?",
+    "Résume les emails à propos de {a} et {b}",
+    "Qui m'a écrit au sujet de {a} ?",
+    "Y a-t-il une {a} en attente pour {b} ?",
+)
+
+def synthetic_rows(start: int, count: int, body_kb: float, seed: int) -> List[tuple]:
+    """Lignes de la table emails, au format de EmailFetcher.upsert_emails"""
+    rng = random.Random(f"{seed}-{start}")
+    rows = []
+    now = datetime.now()
+    for index in range(start, start + count):
+        name, address = rng.choice(SENDERS)
+        size = max(64, int(rng.expovariate(1.0 / (body_kb * 1024))))
+        rows.append((
+            hashlib.sha256(f"bench-{seed}-{index}".encode()).hexdigest(),
+            f"<retrieval-{index}@bench.example>",
+            f"{name} <{address}>",
+            paragraph(rng, rng.randint(3, 8))[:-1],
+            datetime(2024, 1, 1, 8, 0) + timedelta(minutes=37 * index),
+            body_text(rng, size),
+            str(index + 1),
+            now
+        ))
+    return rows
+
+def load_emails(fetcher, start: int, count: int, body_kb: float, seed: int, batch_size: int = 500) -> float:
+    """Ajoute count emails synthétiques en base et retourne la durée du chargement"""
+    started = time.perf_counter()
+    for offset in range(start, start + count, batch_size):
+        fetcher.upsert_emails(synthetic_rows(offset, min(batch_size, start + count - offset), body_kb, seed))
+        fetcher.conn.commit()
+    return time.perf_counter() - started
+
+def make_questions(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [rng.choice(QUESTION_TEMPLATES).format(a=rng.choice(WORDS), b=rng.choice(WORDS)) for _ in range(count)]
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def summarize(values: List[float]) -> dict:
+    """Latences en millisecondes"""
+    return {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p90_ms": percentile(values, 90) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": max(values) * 1000 if values else 0.0
+    }
+
+async def timed_request(send: Callable, question: str) -> dict:
+    """Exécute une recherche et retourne la durée de chacune de ses étapes"""
+    # Trace de la requête, héritée par les tâches et threads de la recherche
+    trace = start_trace()
+    started = time.perf_counter()
+    result = {}
+    try:
+        await send(question)
+    except Exception as e:
+        result['error'] = str(e)
+    result.update(trace.stages)
+    result['total'] = time.perf_counter() - started
+    return result
+
+async def run_load(send: Callable, questions: List[str], qps: float, duration: float) -> dict:
+    """Envoie qps requêtes par seconde pendant duration secondes, sans attendre les réponses
+
+    En boucle ouverte, un serveur saturé accumule du retard : la latence mesurée
+    inclut alors l'attente, comme pour de vrais clients.
+    """
+    total = max(1, int(qps * duration))
+    tasks = []
+    started = time.perf_counter()
+    for i in range(total):
+        delay = started + i / qps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(timed_request(send, questions[i % len(questions)])))
+    traces = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    errors = [trace['error'] for trace in traces if 'error' in trace]
+    succeeded = [trace for trace in traces if 'error' not in trace]
+    return {
+        "requests": total,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "target_qps": qps,
+        "achieved_qps": len(succeeded) / elapsed if elapsed else 0.0,
+        "stages": {
+            name: summarize([trace[name] for trace in succeeded if name in trace])
+            for name in STAGES
+        }
+    }
+
+def api_sender(analyzer, limit: int) -> Callable:
+    """Requêtes POST /api/v1/search via le client de test Quart, sur l'analyseur déjà initialisé"""
+    import app as api
+
+    api.email_analyzer = analyzer
+    client = api.app.test_client()
+
+    async def send(question: str):
+        response = await client.post('/api/v1/search', json={"question": question, "limit": limit})
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {await response.get_data(as_text=True)}")
+        await response.get_json()
+    return send
+
+def print_report(runs: List[dict]):
+    for run in runs:
+        index = run['index']
+        load = run['load']
+        print(f"\n{run['emails']} emails: indexed {index['documents']} documents in {index['seconds']:.2f}s "
+              f"({index['emails_per_second']:.1f} emails/s), {load['achieved_qps']:.1f}/{load['target_qps']:g} qps, "
+              f"{load['errors']} errors")
+        print(f"    {'stage':<14} {'count':>6} {'mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, stats in load['stages'].items():
+            if stats['count']:
+                print(f"    {name:<14} {stats['count']:>6} {stats['mean_ms']:>9.1f} {stats['p50_ms']:>9.1f} "
+                      f"{stats['p90_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+        if load['first_error']:
+            print(f"    first error: {load['first_error']}")
+
+async def run_benchmark(args) -> List[dict]:
+    import email_fetcher
+
+    # Schéma et écritures de la table emails : ceux du fetcher
+    fetcher = email_fetcher.EmailFetcher(email_fetcher.Config())
+    fetcher.connect_db()
+    fetcher.init_schema()
+    fetcher.cursor.execute("TRUNCATE emails")
+    fetcher.conn.commit()
+
+    from email_analyzer import EmailAnalyzer
+
+    analyzer = EmailAnalyzer()
+    if args.target == 'api':
+        send = api_sender(analyzer, args.limit)
+    else:
+        async def send(question: str):
+            await analyzer.search_with_context(question, args.limit, score_threshold=args.score_threshold)
+
+    runs = []
+    loaded = 0
+    try:
+        for size in args.sizes:
+            load_seconds = load_emails(fetcher, loaded, size - loaded, args.body_kb, args.seed)
+            added = size - loaded
+            loaded = size
+
+            started = time.perf_counter()
+            await analyzer.setup_vector_store()
+            index_seconds = time.perf_counter() - started
+
+            questions = make_questions(args.questions, args.seed + size)
+            load = await run_load(send, questions, args.qps, args.duration)
+            runs.append({
+                "emails": size,
+                "index": {
+                    "added_emails": added,
+                    "load_seconds": load_seconds,
+                    "seconds": index_seconds,
+                    "emails_per_second": added / index_seconds if index_seconds else 0.0,
+                    "documents": await asyncio.to_thread(analyzer.collection.count)
+                },
+                "load": load,
+                "cache": analyzer.cache_stats()
+            })
+    finally:
+        await analyzer.aclose()
+        fetcher.cleanup()
+    return runs
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark d'indexation et de recherche de l'API")
+    parser.add_argument('--sizes', default='1000', help="tailles successives du corpus, ex: 1000,10000")
+    parser.add_argument('--body-kb', type=float, default=2.0, help="taille moyenne du corps d'un email, en Ko")
+    parser.add_argument('--qps', type=float, default=10.0, help="débit de recherches visé")
+    parser.add_argument('--duration', type=float, default=30.0, help="durée de la charge par taille, en secondes")
+    parser.add_argument('--questions', type=int, default=1000, help="nombre de questions distinctes")
+    parser.add_argument('--limit', type=int, default=3, help="emails retournés par recherche")
+    parser.add_argument('--score-threshold', type=float, default=0.5, help="seuil vectoriel (cible analyzer)")
+    parser.add_argument('--target', choices=('analyzer', 'api'), default='analyzer',
+                        help="search_with_context directement, ou POST /api/v1/search")
+    parser.add_argument('--embedding-latency-ms', type=float, default=0.0)
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help="délai avant le premier token")
+    parser.add_argument('--llm-token-latency-ms', type=float, default=0.0, help="délai entre deux tokens")
+    parser.add_argument('--cache', action='store_true', help="garde les caches de questions et de réponses")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="fichier JSON de résultats")
+    args = parser.parse_args()
+    args.sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    # Fournisseurs simulés et base de test, sauf configuration explicite
+    os.environ.setdefault('EMBEDDING_BACKEND', 'hashing')
+    os.environ.setdefault('LLM_BACKEND', 'echo')
+    os.environ.setdefault('VECTOR_BACKEND', 'numpy')
+    os.environ.setdefault('EMBEDDING_CACHE', 'off')
+    os.environ.setdefault('DB_HOST', 'localhost')
+    os.environ['EMBEDDING_LATENCY_MS'] = str(args.embedding_latency_ms)
+    os.environ['LLM_LATENCY_MS'] = str(args.llm_latency_ms)
+    os.environ['LLM_TOKEN_LATENCY_MS'] = str(args.llm_token_latency_ms)
+    if not args.cache:
+        os.environ['QUERY_CACHE_SIZE'] = '0'
+        os.environ['ANSWER_CACHE_SIZE'] = '0'
+    vector_store_path = None
+    if 'VECTOR_STORE_PATH' not in os.environ:
+        vector_store_path = tempfile.mkdtemp(prefix='retrieval-benchmark-')
+        os.environ['VECTOR_STORE_PATH'] = vector_store_path
+
+    try:
+        runs = asyncio.run(run_benchmark(args))
+    finally:
+        if vector_store_path:
+            shutil.rmtree(vector_store_path, ignore_errors=True)
+
+    print_report(runs)
+    if args.output:
+        backends = ('EMBEDDING_BACKEND', 'LLM_BACKEND', 'VECTOR_BACKEND', 'SEARCH_MODE', 'EMBEDDING_CACHE')
+        with open(args.output, 'w') as f:
+            json.dump({
+                'parameters': vars(args),
+                'environment': {name: os.getenv(name) for name in backends},
+                'runs': runs
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Génération de boîtes mail synthétiques pour les benchmarks
+
+Les messages sont déterministes (graine fixe) : deux exécutions avec les mêmes
+paramètres produisent exactement les mêmes octets, donc des mesures comparables.
+"""
+import random
+from datetime import datetime, timedelta
+from email.mime.application import MIMEApplication
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+from typing import Dict, List
+
+WORDS = (
+    "facture paiement banque virement commande livraison réunion projet rapport "
+    "contrat devis relance rendez-vous compte client fournisseur équipe planning "
+    "budget trimestre validation document signature abonnement remboursement "
+    "mise à jour sécurité connexion mot de passe confirmation réservation voyage "
+    "hôtel billet train vol colis suivi retour garantie assurance impôts échéance"
+).split()
+
+SENDERS = [
+    ("Banque Populaire", "info@banque.example"),
+    ("Service Client", "support@boutique.example"),
+    ("Alice Martin", "alice.martin@entreprise.example"),
+    ("Bob Durand", "bob.durand@entreprise.example"),
+    ("SNCF Connect", "noreply@train.example"),
+    ("Impots.gouv", "ne-pas-repondre@impots.example"),
+    ("Newsletter Tech", "news@tech.example"),
+    ("Claire Petit", "claire.petit@client.example"),
+]
+
+class MailboxSpec:
+    """Paramètres d'une boîte mail synthétique"""
+
+    def __init__(self, messages: int = 1000, body_kb: float = 4.0, html_ratio: float = 0.5,
+                 attachment_ratio: float = 0.2, attachment_kb: float = 200.0, nested_ratio: float = 0.1,
+                 seed: int = 42):
+        self.messages = messages
+        self.body_kb = body_kb
+        self.html_ratio = html_ratio
+        self.attachment_ratio = attachment_ratio
+        self.attachment_kb = attachment_kb
+        self.nested_ratio = nested_ratio
+        self.seed = seed
+
+def paragraph(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def random_bytes(rng: random.Random, size: int) -> bytes:
+    """Contenu binaire incompressible (pièces jointes)"""
+    return rng.getrandbits(size * 8).to_bytes(size, 'little')
+
+def body_text(rng: random.Random, size: int) -> str:
+    """Texte d'environ size octets, en paragraphes"""
+    paragraphs = []
+    length = 0
+    while length < size:
+        text = paragraph(rng, rng.randint(20, 80))
+        paragraphs.append(text)
+        length += len(text) + 2
+    return "\n\n".join(paragraphs)
+
+def choose_profile(rng: random.Random, spec: MailboxSpec) -> str:
+    """Structure MIME : plain, alternative (texte + HTML), mixed (pièces jointes) ou nested"""
+    if rng.random() < spec.attachment_ratio:
+        return 'nested' if rng.random() < spec.nested_ratio else 'mixed'
+    return 'alternative' if rng.random() < spec.html_ratio else 'plain'
+
+def build_message(rng: random.Random, spec: MailboxSpec, index: int, mailbox: str) -> bytes:
+    """Construit un message RFC 5322 selon un profil MIME tiré au hasard"""
+    name, address = rng.choice(SENDERS)
+    size = max(64, int(rng.expovariate(1.0 / (spec.body_kb * 1024))))
+    text = body_text(rng, size)
+    html = "<html><body>" + "".join(f"<p>{p}</p>" for p in text.split("\n\n")) + "</body></html>"
+    profile = choose_profile(rng, spec)
+
+    if profile == 'plain':
+        message = MIMEText(text, 'plain', 'utf-8')
+    else:
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText(text, 'plain', 'utf-8'))
+        alternative.attach(MIMEText(html, 'html', 'utf-8'))
+        if profile == 'alternative':
+            message = alternative
+        else:
+            message = MIMEMultipart('mixed')
+            if profile == 'nested':
+                # mixed > related > alternative, avec une image en ligne
+                related = MIMEMultipart('related')
+                related.attach(alternative)
+                image = MIMEImage(random_bytes(rng, 2048), 'png')
+                image.add_header('Content-ID', f'<logo{index}@bench>')
+                related.attach(image)
+                message.attach(related)
+            else:
+                message.attach(alternative)
+            for attachment_index in range(rng.randint(1, 3)):
+                attachment_size = max(1024, int(rng.expovariate(1.0 / (spec.attachment_kb * 1024))))
+                attachment = MIMEApplication(random_bytes(rng, attachment_size), 'pdf')
+                attachment.add_header('Content-Disposition', 'attachment',
+                                      filename=f'document-{index}-{attachment_index}.pdf')
+                message.attach(attachment)
+
+    date = datetime(2024, 1, 1, 8, 0) + timedelta(minutes=37 * index)
+    message['Message-ID'] = f'<{mailbox.lower()}-{index}@bench.example>'
+    message['Date'] = format_datetime(date)
+    message['From'] = f'{name} <{address}>'
+    message['To'] = 'moi@bench.example'
+    message['Subject'] = paragraph(rng, rng.randint(3, 8))[:-1]
+    return message.as_bytes()
+
+def generate_mailboxes(mailboxes: Dict[str, MailboxSpec], duplicate_ratio: float = 0.0) -> Dict[str, List[bytes]]:
+    """Génère les messages de chaque boîte mail
+
+    duplicate_ratio copie une part des messages de la première boîte dans les
+    suivantes (comme un dossier "Tous les messages") pour exercer la déduplication.
+    """
+    generated = {}
+    first = None
+    for position, (mailbox, spec) in enumerate(mailboxes.items()):
+        rng = random.Random(f"{spec.seed}-{mailbox}")
+        messages = [build_message(rng, spec, index, mailbox) for index in range(spec.messages)]
+        if first is not None and duplicate_ratio > 0:
+            messages.extend(rng.sample(first, int(len(first) * duplicate_ratio)))
+        if position == 0:
+            first = messages
+        generated[mailbox] = messages
+    return generated
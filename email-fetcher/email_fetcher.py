@@ -1,8 +1,10 @@
 import imaplib
 import email
 from email.message import Message
+from email.parser import BytesFeedParser
+from email.policy import compat32
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
 from datetime import datetime
 import hashlib
 import os
@@ -10,22 +12,129 @@ import sys
 from email.header import decode_header
 from dotenv import load_dotenv
 import time
-from tqdm import tqdm
 import ssl
-from typing import Set, Dict, List
+from typing import Set, Dict, List, Optional, Tuple
+from concurrent.futures import Future, ProcessPoolExecutor
 import logging
+import multiprocessing
+import queue
+import re
+import select
+import threading
 from pathlib import Path
+from prometheus_client import Counter, Histogram, start_http_server
 
 # Configuration du logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s',
     handlers=[
         logging.StreamHandler(sys.stdout)
     ]
 )
 logger = logging.getLogger(__name__)
 
+# Métriques Prometheus, exposées sur METRICS_PORT (exporteur HTTP optionnel)
+STAGE_SECONDS = Histogram(
+    'email_fetcher_stage_seconds',
+    "Durée des étapes d'ingestion, par lot (imap_fetch_headers, imap_fetch_bodies, mime_parse, db_upsert...)",
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+MESSAGES_INGESTED = Counter('email_fetcher_messages_ingested_total', "Emails analysés et enregistrés", ['mailbox'])
+BYTES_DOWNLOADED = Counter('email_fetcher_downloaded_bytes_total', "Octets téléchargés (en-têtes et corps)", ['mailbox'])
+SYNC_ERRORS = Counter('email_fetcher_errors_total', "Erreurs de synchronisation", ['mailbox', 'stage'])
+
+# Expressions utilisées pour découper les réponses FETCH multi-messages
+FETCH_START_RE = re.compile(rb'^\d+ \(')
+FETCH_LITERAL_RE = re.compile(rb'([A-Z0-9.]+(?:\[[^\]]*\])?(?:<\d+>)?) \{\d+\}$', re.IGNORECASE)
+FETCH_UID_RE = re.compile(rb'\bUID (\d+)', re.IGNORECASE)
+FETCH_SIZE_RE = re.compile(rb'\bRFC822\.SIZE (\d+)', re.IGNORECASE)
+STATUS_RE = re.compile(rb'\(([^)]*)\)\s*$')
+# Dossiers de la réponse LIST qui ne peuvent pas être sélectionnés (ex: "[Gmail]")
+NOSELECT_RE = re.compile(rb'^\([^)]*\\(?:Noselect|NonExistent)\b', re.IGNORECASE)
+
+# Taille des morceaux transmis au parseur MIME
+PARSE_CHUNK_SIZE = 64 * 1024
+
+class TextOnlyMessage(Message):
+    """Message dont seules les parties texte (hors pièces jointes) conservent leur contenu
+
+    Utilisé comme fabrique par BytesFeedParser : le contenu des pièces jointes est
+    abandonné dès la fin de leur analyse au lieu de rester attaché au message.
+    """
+
+    def set_payload(self, payload, charset=None):
+        if (isinstance(payload, str)
+                and (self.get_content_maintype() != 'text'
+                     or self.get_content_disposition() == 'attachment')):
+            payload = ''
+        super().set_payload(payload, charset)
+
+# En-têtes récupérés lors de la première phase : ceux du hash, plus ceux
+# nécessaires pour reconstruire la structure MIME avec BODY[TEXT]
+HEADER_FIELDS = ('MESSAGE-ID DATE FROM SUBJECT TO CC BCC '
+                 'MIME-VERSION CONTENT-TYPE CONTENT-TRANSFER-ENCODING')
+
+# Schéma de la base, créé au démarrage par init_database
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    id SERIAL PRIMARY KEY,
+    unique_id TEXT UNIQUE,
+    message_id TEXT,
+    sender TEXT NOT NULL,
+    subject TEXT,
+    date TIMESTAMP,
+    body TEXT,
+    imap_uid TEXT,
+    last_seen TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_unique_id ON emails(unique_id);
+CREATE INDEX IF NOT EXISTS idx_imap_uid ON emails(imap_uid);
+CREATE INDEX IF NOT EXISTS idx_last_seen ON emails(last_seen);
+CREATE INDEX IF NOT EXISTS idx_emails_date ON emails(date);
+
+-- Emplacements (boîte mail, UID) où chaque email a été vu
+CREATE TABLE IF NOT EXISTS email_locations (
+    mailbox TEXT NOT NULL,
+    imap_uid BIGINT NOT NULL,
+    unique_id TEXT NOT NULL,
+    last_seen TIMESTAMP NOT NULL,
+    PRIMARY KEY (mailbox, imap_uid)
+);
+
+CREATE INDEX IF NOT EXISTS idx_locations_unique_id ON email_locations(unique_id);
+CREATE INDEX IF NOT EXISTS idx_locations_last_seen ON email_locations(mailbox, last_seen);
+
+CREATE TABLE IF NOT EXISTS mailbox_sync_state (
+    mailbox TEXT PRIMARY KEY,
+    uidvalidity BIGINT,
+    last_uid BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Colonnes ajoutées après la création des tables : (table, colonne, instructions).
+# ALTER TABLE prend un verrou exclusif même si la colonne existe déjà, il n'est
+# donc exécuté que si information_schema ne la connaît pas encore
+SCHEMA_MIGRATIONS = (
+    # Index plein texte utilisé par la recherche hybride de l'API
+    # (corps tronqué : un tsvector est limité à 1 Mo)
+    ('emails', 'search_vector', """
+        ALTER TABLE emails ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('french', coalesce(subject, '')), 'A') ||
+                setweight(to_tsvector('french', coalesce(sender, '')), 'B') ||
+                setweight(to_tsvector('french', left(coalesce(body, ''), 100000)), 'C')
+            ) STORED;
+        CREATE INDEX IF NOT EXISTS idx_emails_search_vector ON emails USING GIN (search_vector);
+    """),
+    ('mailbox_sync_state', 'highestmodseq',
+     "ALTER TABLE mailbox_sync_state ADD COLUMN IF NOT EXISTS highestmodseq BIGINT"),
+)
+
 class Config:
     def __init__(self):
         # Configuration email
@@ -33,6 +142,8 @@ class Config:
         self.PASSWORD = os.getenv('EMAIL_PASSWORD')
         self.IMAP_SERVER = os.getenv('IMAP_SERVER')
         self.IMAP_PORT = int(os.getenv('IMAP_PORT', '993'))
+        # IMAP en clair uniquement pour un serveur local (ex: serveur de benchmark)
+        self.IMAP_SSL = os.getenv('IMAP_SSL', 'true').lower() != 'false'
         
         # Configuration PostgreSQL
         self.DB_HOST = os.getenv('DB_HOST', 'db')
@@ -42,6 +153,28 @@ class Config:
         self.DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')
         
         self.BATCH_SIZE = int(os.getenv('BATCH_SIZE', '100'))
+        self.BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', str(20 * 1024 * 1024)))
+        self.IMAP_CONCURRENCY = int(os.getenv('IMAP_CONCURRENCY', '4'))
+        self.MAILBOX_SPLIT_SIZE = int(os.getenv('MAILBOX_SPLIT_SIZE', '5000'))
+        self.CLEANUP_BATCH_SIZE = int(os.getenv('CLEANUP_BATCH_SIZE', '1000'))
+
+        # Mode push : sessions IDLE (ou polling léger) sur les dossiers surveillés
+        self.SYNC_MODE = os.getenv('SYNC_MODE', 'poll')
+        self.PUSH_FOLDERS = [folder.strip() for folder in os.getenv('PUSH_FOLDERS', 'INBOX').split(',')
+                             if folder.strip()]
+        self.IDLE_TIMEOUT = int(os.getenv('IDLE_TIMEOUT', '600'))
+        self.PUSH_POLL_INTERVAL = int(os.getenv('PUSH_POLL_INTERVAL', '30'))
+
+        # Limites mémoire de l'analyse des messages
+        self.MAX_MESSAGE_BYTES = int(os.getenv('MAX_MESSAGE_BYTES', str(10 * 1024 * 1024)))
+        self.MAX_BODY_SIZE = int(os.getenv('MAX_BODY_SIZE', '1000000'))
+
+        # Pipeline d'ingestion : processus d'analyse MIME et lots en attente d'écriture
+        self.PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', str(os.cpu_count() or 1)))
+        self.PIPELINE_DEPTH = int(os.getenv('PIPELINE_DEPTH', '4'))
+
+        # Exporteur Prometheus : désactivé si METRICS_PORT vaut 0
+        self.METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
         self.FETCH_INTERVAL = int(os.getenv('FETCH_INTERVAL', '3600'))
 
     def validate(self):
@@ -60,13 +193,110 @@ class Config:
         
         logger.info(f"Configuration validated. Using IMAP server: {self.IMAP_SERVER}:{self.IMAP_PORT}")
 
-class EmailFetcher:
+class MailboxSyncPlan:
+    """UIDs à synchroniser pour une boîte mail, partagés entre les workers"""
+
+    def __init__(self, mailbox: str, uidvalidity: Optional[int], full_resync: bool, uids: List[int]):
+        self.mailbox = mailbox
+        self.uidvalidity = uidvalidity
+        self.full_resync = full_resync
+        self.uids = uids
+        self.started_at = datetime.now()
+        self.processed_hashes = set()
+        self.failed = False
+        self.remaining_chunks = 0
+        self._done = set()
+        self._done_index = 0
+        self._lock = threading.Lock()
+
+    def split(self, chunk_size: int) -> List[List[int]]:
+        """Découpe les UIDs en plages traitées indépendamment"""
+        chunks = [self.uids[i:i + chunk_size] for i in range(0, len(self.uids), chunk_size)]
+        self.remaining_chunks = len(chunks)
+        return chunks
+
+    def checkpoint(self, uids: List[int]) -> Optional[int]:
+        """Plus haut UID dont tous les précédents sont traités, en comptant le lot donné comme traité"""
+        with self._lock:
+            batch = set(uids)
+            index = self._done_index
+            while index < len(self.uids) and (self.uids[index] in self._done or self.uids[index] in batch):
+                index += 1
+            return self.uids[index - 1] if index else None
+
+    def mark_done(self, uids: List[int], hashes: Set[str]):
+        """Marque un lot comme traité, une fois enregistré en base"""
+        with self._lock:
+            self.processed_hashes.update(hashes)
+            self._done.update(uids)
+            while self._done_index < len(self.uids) and self.uids[self._done_index] in self._done:
+                self._done.discard(self.uids[self._done_index])
+                self._done_index += 1
+
+    def completed_full_resync(self) -> bool:
+        """Indique si tous les UIDs de la boîte mail ont été parcourus sans erreur"""
+        with self._lock:
+            return self.full_resync and not self.failed and self.remaining_chunks <= 0
+
+    def finish_chunk(self, failed: bool = False) -> bool:
+        """Termine une plage et indique si c'était la dernière de la boîte mail"""
+        with self._lock:
+            self.failed = self.failed or failed
+            self.remaining_chunks -= 1
+            return self.remaining_chunks == 0
+
+class PipelineStats:
+    """Compteurs de débit par étape du pipeline d'ingestion (download, parse, write)
+
+    "busy" est le temps passé à travailler, "blocked" le temps passé à attendre
+    une autre étape : l'étape la plus lente est celle dont les autres attendent.
+    """
+
     def __init__(self):
-        self.config = Config()
-        self.config.validate()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, messages: int, nbytes: int = 0, busy: float = 0.0, blocked: float = 0.0):
+        with self._lock:
+            counters = self.stages.setdefault(stage, {'messages': 0, 'bytes': 0, 'busy': 0.0, 'blocked': 0.0})
+            counters['messages'] += messages
+            counters['bytes'] += nbytes
+            counters['busy'] += busy
+            counters['blocked'] += blocked
+
+    def summary(self) -> str:
+        with self._lock:
+            return '; '.join(
+                f"{stage}: {c['messages']} msgs, {c['bytes'] / 1e6:.1f} MB, busy {c['busy']:.1f}s "
+                f"({c['messages'] / c['busy'] if c['busy'] else 0:.1f} msg/s), blocked {c['blocked']:.1f}s"
+                for stage, c in self.stages.items()
+            )
+
+class EmailFetcher:
+    def __init__(self, config: Optional[Config] = None):
+        if config is None:
+            config = Config()
+            config.validate()
+        self.config = config
         self.imap_server = None
+        self.capabilities = set()
+        self.selected_mailbox = None
         self.conn = None
         self.cursor = None
+        self.lookup_conn = None
+        self.lookup_cursor = None
+        self.parse_pool = None
+        self.stats = PipelineStats()
+
+    def open_db_connection(self):
+        """Ouvre une connexion PostgreSQL avec la configuration courante"""
+        return psycopg2.connect(
+            host=self.config.DB_HOST,
+            port=self.config.DB_PORT,
+            dbname=self.config.DB_NAME,
+            user=self.config.DB_USER,
+            password=self.config.DB_PASSWORD
+        )
 
     def connect_db(self):
         """Établit la connexion à PostgreSQL avec retry"""
@@ -75,37 +305,16 @@ class EmailFetcher:
         
         for attempt in range(max_retries):
             try:
-                self.conn = psycopg2.connect(
-                    host=self.config.DB_HOST,
-                    port=self.config.DB_PORT,
-                    dbname=self.config.DB_NAME,
-                    user=self.config.DB_USER,
-                    password=self.config.DB_PASSWORD
-                )
+                self.conn = self.open_db_connection()
                 self.cursor = self.conn.cursor(cursor_factory=DictCursor)
+
+                # Connexion en lecture seule de l'étape de téléchargement (déduplication),
+                # indépendante de la transaction de l'étape d'écriture
+                self.lookup_conn = self.open_db_connection()
+                self.lookup_conn.autocommit = True
+                self.lookup_cursor = self.lookup_conn.cursor(cursor_factory=DictCursor)
                 
-                # Création de la table si elle n'existe pas
-                self.cursor.execute("""
-                CREATE TABLE IF NOT EXISTS emails (
-                    id SERIAL PRIMARY KEY,
-                    unique_id TEXT UNIQUE,
-                    message_id TEXT,
-                    sender TEXT NOT NULL,
-                    subject TEXT,
-                    date TIMESTAMP,
-                    body TEXT,
-                    imap_uid TEXT,
-                    last_seen TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-                
-                CREATE INDEX IF NOT EXISTS idx_unique_id ON emails(unique_id);
-                CREATE INDEX IF NOT EXISTS idx_imap_uid ON emails(imap_uid);
-                CREATE INDEX IF NOT EXISTS idx_last_seen ON emails(last_seen);
-                """)
-                
-                self.conn.commit()
-                logger.info("Database connection established and schema initialized")
+                logger.info("Database connection established")
                 return
                 
             except Exception as e:
@@ -116,6 +325,24 @@ class EmailFetcher:
                 else:
                     raise
 
+    def init_schema(self):
+        """Crée les tables et applique les migrations manquantes
+
+        Exécuté une seule fois au démarrage, avant les workers et les sessions push :
+        ces instructions prennent des verrous qui bloqueraient les autres connexions.
+        """
+        self.cursor.execute(SCHEMA)
+        for table, column, migration in SCHEMA_MIGRATIONS:
+            self.cursor.execute("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+            """, (table, column))
+            if self.cursor.fetchone() is None:
+                logger.info(f"Adding column {table}.{column}")
+                self.cursor.execute(migration)
+        self.conn.commit()
+        logger.info("Database schema initialized")
+
     def get_existing_emails(self) -> Dict[str, str]:
         """Récupère les emails existants dans la base de données"""
         try:
@@ -125,81 +352,399 @@ class EmailFetcher:
             logger.error(f"Error fetching existing emails: {str(e)}")
             return {}
 
-    def process_email_batch(self, uids: List[bytes]):
-        """Traite un lot d'emails"""
-        processed_hashes = set()
-        
+    def build_uid_set(self, uids: List[int]) -> str:
+        """Construit un ensemble d'UIDs IMAP compact (ex: 1,5,7:20)"""
+        ranges = []
+        for uid in sorted(set(uids)):
+            if ranges and uid == ranges[-1][1] + 1:
+                ranges[-1][1] = uid
+            else:
+                ranges.append([uid, uid])
+        return ','.join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+    def parse_fetch_response(self, msg_data: list) -> Dict[int, Dict[str, object]]:
+        """Regroupe par UID les éléments d'une réponse UID FETCH multi-messages"""
+        messages = []
+        current = None
+
+        def parse_attributes(text: bytes):
+            uid_match = FETCH_UID_RE.search(text)
+            if uid_match:
+                current['UID'] = int(uid_match.group(1))
+            size_match = FETCH_SIZE_RE.search(text)
+            if size_match:
+                current['RFC822.SIZE'] = int(size_match.group(1))
+
+        for item in msg_data or []:
+            if isinstance(item, tuple):
+                header, literal = item
+                if FETCH_START_RE.match(header) or current is None:
+                    current = {}
+                    messages.append(current)
+                parse_attributes(header)
+                literal_match = FETCH_LITERAL_RE.search(header)
+                if literal_match:
+                    name = literal_match.group(1).decode().upper().replace('.PEEK', '')
+                    current[name] = literal
+            elif isinstance(item, bytes):
+                # Réponse sans littéral, ou fin d'une réponse (")" ou " UID 12)")
+                if FETCH_START_RE.match(item):
+                    current = {}
+                    messages.append(current)
+                if current is not None:
+                    parse_attributes(item)
+
+        # Un FETCH non sollicité (FLAGS...) peut répéter l'UID d'un message de la réponse :
+        # ses attributs complètent ceux déjà reçus au lieu de les remplacer
+        merged = {}
+        for message in messages:
+            if 'UID' in message:
+                merged.setdefault(message['UID'], {}).update(message)
+        return merged
+
+    def split_batches(self, uids: List[int], sizes: Dict[int, int]):
+        """Découpe les UIDs en lots limités en nombre de messages et en octets"""
+        batch = []
+        batch_bytes = 0
         for uid in uids:
+            size = sizes.get(uid, 0)
+            if batch and (len(batch) >= self.config.BATCH_SIZE
+                          or batch_bytes + size > self.config.BATCH_MAX_BYTES):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(uid)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def fetch_headers(self, uids: List[int]) -> Dict[int, Dict[str, object]]:
+        """Première phase : récupère uniquement les en-têtes et la taille des messages"""
+        with STAGE_SECONDS.labels('imap_fetch_headers').time():
+            typ, msg_data = self.imap_server.uid(
+                'fetch',
+                self.build_uid_set(uids),
+                f'(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])'
+            )
+        # Un NO n'est pas levé par imaplib : sans ce contrôle, le lot serait marqué traité
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"Header fetch failed for batch of {len(uids)} emails: {msg_data}")
+
+        headers = {}
+        for uid, items in self.parse_fetch_response(msg_data).items():
+            header = next((value for name, value in items.items()
+                           if name.startswith('BODY[HEADER')), None)
+            if header is None:
+                continue
+            headers[uid] = {
+                'unique_id': self.generate_email_hash(email.message_from_bytes(header)),
+                'header': header,
+                'size': items.get('RFC822.SIZE', 0)
+            }
+        return headers
+
+    def get_known_emails(self, unique_ids: Set[str]) -> Set[str]:
+        """Retourne, parmi les identifiants donnés, ceux déjà présents en base"""
+        if not unique_ids:
+            return set()
+        with STAGE_SECONDS.labels('db_lookup').time():
+            self.lookup_cursor.execute(
+                "SELECT unique_id FROM emails WHERE unique_id = ANY(%s)",
+                (list(unique_ids),)
+            )
+            return {row['unique_id'] for row in self.lookup_cursor.fetchall()}
+
+    def touch_emails(self, seen: Dict[str, int]):
+        """Met à jour l'UID et la date de dernière vue des emails déjà connus"""
+        if not seen:
+            return
+        execute_values(self.cursor, """
+            UPDATE emails SET imap_uid = data.imap_uid, last_seen = data.last_seen
+            FROM (VALUES %s) AS data (unique_id, imap_uid, last_seen)
+            WHERE emails.unique_id = data.unique_id
+        """, [(unique_id, str(uid), datetime.now()) for unique_id, uid in seen.items()])
+
+    def record_locations(self, mailbox: str, locations: Dict[int, str]):
+        """Marque les messages comme vus dans la boîte mail (phase "mark" du nettoyage)"""
+        if not locations:
+            return
+        now = datetime.now()
+        execute_values(self.cursor, """
+            INSERT INTO email_locations (mailbox, imap_uid, unique_id, last_seen)
+            VALUES %s
+            ON CONFLICT (mailbox, imap_uid)
+            DO UPDATE SET
+                unique_id = EXCLUDED.unique_id,
+                last_seen = EXCLUDED.last_seen
+        """, [(mailbox, uid, unique_id, now) for uid, unique_id in locations.items()],
+            page_size=self.config.BATCH_SIZE)
+
+    def download_batch(self, uids: List[int]) -> Dict[str, object]:
+        """Étape de téléchargement : en-têtes, déduplication, puis corps des emails inconnus"""
+        # Une erreur ici (en-têtes ou corps) interrompt la boîte mail : le point de
+        # reprise n'avance pas et le nettoyage n'est pas lancé sur une liste incomplète
+        headers = self.fetch_headers(uids)
+        expunged = self.find_expunged_uids([uid for uid in uids if uid not in headers])
+
+        # Déduplication en masse avant tout téléchargement de corps
+        uid_by_hash = {}
+        for uid, entry in headers.items():
+            uid_by_hash.setdefault(entry['unique_id'], uid)
+
+        known = self.get_known_emails(set(uid_by_hash))
+        pending = sorted(uid for unique_id, uid in uid_by_hash.items() if unique_id not in known)
+        if pending:
+            logger.info(f"{len(known)} emails already known, downloading {len(pending)} bodies")
+
+        sizes = {uid: min(headers[uid]['size'], self.config.MAX_MESSAGE_BYTES) for uid in pending}
+        bodies = []
+        for body_batch in self.split_batches(pending, sizes):
+            for uid, body in self.fetch_bodies(body_batch).items():
+                bodies.append((uid, headers[uid]['header'], headers[uid]['unique_id'], body))
+
+        return {
+            'uids': uids,
+            'hashes': set(uid_by_hash),
+            'locations': {uid: entry['unique_id'] for uid, entry in headers.items()},
+            'known': {unique_id: uid for unique_id, uid in uid_by_hash.items() if unique_id in known},
+            'pending': {headers[uid]['unique_id'] for uid in pending},
+            'expunged': expunged,
+            'bodies': bodies,
+            'bytes': sum(len(entry['header']) for entry in headers.values())
+                     + sum(len(body[3]) for body in bodies)
+        }
+
+    def find_expunged_uids(self, uids: List[int]) -> Set[int]:
+        """Parmi des UIDs absents d'une réponse FETCH, retourne ceux qui n'existent plus sur le serveur"""
+        if not uids:
+            return set()
+        typ, messages = self.imap_server.uid('search', None, f'UID {self.build_uid_set(uids)}')
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"UID search failed for {len(uids)} missing emails: {messages}")
+        present = {int(uid) for uid in messages[0].split()}
+        return set(uids) - present
+
+    def fetch_bodies(self, uids: List[int]) -> Dict[int, bytes]:
+        """Seconde phase : télécharge BODY[TEXT] des emails inconnus"""
+        # Fetch partiel : au-delà de MAX_MESSAGE_BYTES, on ne trouve en pratique que des pièces jointes
+        with STAGE_SECONDS.labels('imap_fetch_bodies').time():
+            typ, msg_data = self.imap_server.uid(
+                'fetch',
+                self.build_uid_set(uids),
+                f'(UID BODY.PEEK[TEXT]<0.{self.config.MAX_MESSAGE_BYTES}>)'
+            )
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f"Body fetch failed for batch of {len(uids)} emails: {msg_data}")
+
+        bodies = {}
+        for uid, items in self.parse_fetch_response(msg_data).items():
+            body = next((value for name, value in items.items()
+                         if name.startswith('BODY[TEXT]')), None)
+            if body is not None:
+                bodies[uid] = body
+        return bodies
+
+    def build_email_row(self, uid: int, header: bytes, unique_id: str, body: bytes) -> tuple:
+        """Analyse un email téléchargé et construit la ligne à enregistrer"""
+        msg = self.parse_message(header, body)
+        return (
+            unique_id,
+            msg.get('Message-ID', ''),
+            self.decode_email_header(msg.get('From', 'Unknown')),
+            self.decode_email_header(msg.get('Subject', 'No Subject')),
+            self.parse_date(msg.get('Date')),
+            self.get_email_body(msg),
+            str(uid),
+            datetime.now()
+        )
+
+    def submit_parse(self, bodies: List[tuple]) -> Future:
+        """Confie l'analyse MIME d'un lot au pool de processus (ou l'exécute sur place)"""
+        if self.parse_pool is not None:
+            return self.parse_pool.submit(parse_email_rows, self.config, bodies)
+        future = Future()
+        future.set_result(parse_email_rows(self.config, bodies))
+        return future
+
+    def run_write_stage(self, plan: MailboxSyncPlan, jobs: queue.Queue, errors: List[Exception]):
+        """Étape d'écriture : enregistre chaque lot analysé et avance le point de reprise"""
+        while True:
+            waiting_since = time.perf_counter()
+            job = jobs.get()
+            if job is None:
+                return
+            # Après une erreur, la file est vidée pour ne pas bloquer le téléchargement
+            if errors:
+                continue
+
             try:
-                _, msg_data = self.imap_server.uid('fetch', uid, '(RFC822)')
-                if not msg_data or not msg_data[0]:
-                    continue
-                
-                email_body = msg_data[0][1]
-                msg = email.message_from_bytes(email_body)
-                
-                unique_id = self.generate_email_hash(msg)
-                processed_hashes.add(unique_id)
-                
-                # Utilisation de l'UPSERT de PostgreSQL
-                self.cursor.execute("""
-                INSERT INTO emails 
-                    (unique_id, message_id, sender, subject, date, body, imap_uid, last_seen)
-                VALUES
-                    (%s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (unique_id) 
-                DO UPDATE SET
-                    message_id = EXCLUDED.message_id,
-                    sender = EXCLUDED.sender,
-                    subject = EXCLUDED.subject,
-                    date = EXCLUDED.date,
-                    body = EXCLUDED.body,
-                    imap_uid = EXCLUDED.imap_uid,
-                    last_seen = EXCLUDED.last_seen
-                """, (
-                    unique_id,
-                    msg.get('Message-ID', ''),
-                    self.decode_email_header(msg.get('From', 'Unknown')),
-                    self.decode_email_header(msg.get('Subject', 'No Subject')),
-                    self.parse_date(msg.get('Date')),
-                    self.get_email_body(msg),
-                    uid.decode(),
-                    datetime.now()
-                ))
-                
+                rows, parse_time, parse_errors = job['parsed'].result()
+                started = time.perf_counter()
+                self.stats.record('parse', len(rows), job['body_bytes'], parse_time)
+                STAGE_SECONDS.labels('mime_parse').observe(parse_time)
+                if parse_errors:
+                    SYNC_ERRORS.labels(plan.mailbox, 'parse').inc(parse_errors)
+
+                self.record_locations(plan.mailbox, job['locations'])
+                self.touch_emails(job['known'])
+                with STAGE_SECONDS.labels('db_upsert').time():
+                    self.upsert_emails(rows)
+
+                # Les emails non téléchargés ou non analysés bloquent le point de reprise :
+                # ils seront repris au prochain cycle. Un UID absent de la réponse n'est
+                # traité que si le serveur a confirmé sa suppression
+                failed = job['pending'] - {row[0] for row in rows}
+                locations = job['locations']
+                done = [uid for uid in job['uids']
+                        if uid in job['expunged'] or (uid in locations and locations[uid] not in failed)]
+                if len(done) < len(job['uids']):
+                    logger.warning(f"{len(job['uids']) - len(done)} emails of {plan.mailbox} not stored, "
+                                   f"they will be retried next cycle")
+                if len(locations) + len(job['expunged']) < len(job['uids']):
+                    # Emplacements incomplets : le nettoyage supprimerait des emails encore présents
+                    plan.failed = True
+
+                # Point de reprise enregistré dans la même transaction que le lot
+                checkpoint = plan.checkpoint(done)
+                if plan.uidvalidity is not None and checkpoint is not None:
+                    self.save_sync_state(plan.mailbox, plan.uidvalidity, checkpoint)
+
+                # Commit après chaque lot ; le lot n'est marqué traité qu'une fois enregistré
+                with STAGE_SECONDS.labels('db_commit').time():
+                    self.conn.commit()
+                plan.mark_done(done, job['hashes'] - failed)
+                MESSAGES_INGESTED.labels(plan.mailbox).inc(len(rows))
+                self.stats.record('write', len(job['uids']), 0, time.perf_counter() - started,
+                                  started - waiting_since)
+
             except Exception as e:
-                logger.error(f"Error processing email {uid}: {str(e)}")
-                continue
-                
-        return processed_hashes
+                logger.error(f"Error writing batch of {plan.mailbox}: {str(e)}")
+                SYNC_ERRORS.labels(plan.mailbox, 'write').inc()
+                self.conn.rollback()
+                errors.append(e)
+
+    def upsert_emails(self, rows: List[tuple]) -> int:
+        """Enregistre un lot d'emails en un seul UPSERT et retourne le nombre de lignes écrites"""
+        if not rows:
+            return 0
+
+        # Les lignes identiques ne sont pas réécrites : seul last_seen est mis à jour
+        written = execute_values(self.cursor, """
+            INSERT INTO emails
+                (unique_id, message_id, sender, subject, date, body, imap_uid, last_seen)
+            VALUES %s
+            ON CONFLICT (unique_id)
+            DO UPDATE SET
+                message_id = EXCLUDED.message_id,
+                sender = EXCLUDED.sender,
+                subject = EXCLUDED.subject,
+                date = EXCLUDED.date,
+                body = EXCLUDED.body,
+                imap_uid = EXCLUDED.imap_uid,
+                last_seen = EXCLUDED.last_seen
+            WHERE (emails.message_id, emails.sender, emails.subject, emails.date, emails.body, emails.imap_uid)
+                IS DISTINCT FROM
+                  (EXCLUDED.message_id, EXCLUDED.sender, EXCLUDED.subject, EXCLUDED.date, EXCLUDED.body, EXCLUDED.imap_uid)
+            RETURNING unique_id
+        """, rows, page_size=self.config.BATCH_SIZE, fetch=True)
 
-    def cleanup_old_emails(self, current_hashes: Set[str]) -> int:
-        """Supprime les emails qui ne sont plus sur le serveur"""
+        written_ids = {row[0] for row in written}
+        self.touch_emails({row[0]: row[6] for row in rows if row[0] not in written_ids})
+        return len(written_ids)
+
+    def cleanup_old_emails(self, mailbox: str, started_at: datetime) -> int:
+        """Supprime les emails qui ne sont plus sur le serveur (phase "sweep" du nettoyage)
+
+        Seuls les emplacements de cette boîte mail non revus depuis started_at sont
+        supprimés, par lots ; un email n'est supprimé que lorsqu'il n'est plus
+        présent dans aucune boîte mail.
+        """
         try:
-            if not current_hashes:
-                return 0
-            
-            # Utilisation de chunks pour les grandes suppressions
-            chunk_size = 1000
-            all_hashes = list(current_hashes)
             removed_total = 0
-            
-            for i in range(0, len(all_hashes), chunk_size):
-                chunk = all_hashes[i:i + chunk_size]
+            while True:
                 self.cursor.execute("""
-                    DELETE FROM emails 
-                    WHERE unique_id NOT IN %s
-                """, (tuple(chunk),))
-                
-                removed_total += self.cursor.rowcount
+                    DELETE FROM email_locations
+                    WHERE (mailbox, imap_uid) IN (
+                        SELECT mailbox, imap_uid FROM email_locations
+                        WHERE mailbox = %s AND last_seen < %s
+                        LIMIT %s
+                    )
+                    RETURNING unique_id
+                """, (mailbox, started_at, self.config.CLEANUP_BATCH_SIZE))
+                stale_ids = list({row['unique_id'] for row in self.cursor.fetchall()})
+                if not stale_ids:
+                    self.conn.commit()
+                    return removed_total
+
+                removed_total += self.delete_orphan_emails(stale_ids)
                 self.conn.commit()
-            
-            return removed_total
-            
+
         except Exception as e:
-            logger.error(f"Error during cleanup: {str(e)}")
+            logger.error(f"Error during cleanup of {mailbox}: {str(e)}")
+            self.conn.rollback()
             return 0
-        
+
+    def cleanup_unlocated_emails(self, started_at: datetime) -> int:
+        """Supprime, par lots, les emails sans emplacement non revus depuis started_at
+
+        Les emails enregistrés avant l'ajout de email_locations n'y ont aucun
+        emplacement : le nettoyage par boîte mail ne les atteint pas. À lancer
+        uniquement après une resynchronisation complète de toutes les boîtes mail.
+        """
+        try:
+            removed_total = 0
+            while True:
+                # last_seen est revérifié sur la ligne verrouillée : un email revu entre-temps
+                # (session push) est conservé
+                self.cursor.execute("""
+                    DELETE FROM emails
+                    WHERE id IN (
+                        SELECT id FROM emails
+                        WHERE (last_seen IS NULL OR last_seen < %s)
+                          AND NOT EXISTS (
+                              SELECT 1 FROM email_locations
+                              WHERE email_locations.unique_id = emails.unique_id
+                          )
+                        LIMIT %s
+                    )
+                    AND (last_seen IS NULL OR last_seen < %s)
+                """, (started_at, self.config.CLEANUP_BATCH_SIZE, started_at))
+                removed = self.cursor.rowcount
+                self.conn.commit()
+                removed_total += removed
+                if removed < self.config.CLEANUP_BATCH_SIZE:
+                    return removed_total
+
+        except Exception as e:
+            logger.error(f"Error during cleanup of emails without location: {str(e)}")
+            self.conn.rollback()
+            return 0
+
+    def delete_orphan_emails(self, unique_ids: List[str]) -> int:
+        """Supprime, parmi les emails donnés, ceux qui ne sont plus dans aucune boîte mail"""
+        if not unique_ids:
+            return 0
+        self.cursor.execute("""
+            DELETE FROM emails
+            WHERE unique_id = ANY(%s)
+              AND NOT EXISTS (
+                  SELECT 1 FROM email_locations
+                  WHERE email_locations.unique_id = emails.unique_id
+              )
+        """, (unique_ids,))
+        return self.cursor.rowcount
+
+    def remove_locations(self, mailbox: str, uids: List[int]) -> int:
+        """Retire des UIDs supprimés d'une boîte mail et les emails devenus orphelins"""
+        if not uids:
+            return 0
+        self.cursor.execute("""
+            DELETE FROM email_locations
+            WHERE mailbox = %s AND imap_uid = ANY(%s)
+            RETURNING unique_id
+        """, (mailbox, uids))
+        return self.delete_orphan_emails(list({row['unique_id'] for row in self.cursor.fetchall()}))
+
     def decode_email_header(self, header_string):
         """Décode les en-têtes d'email qui peuvent contenir différents encodages"""
         if not header_string:
@@ -244,17 +789,23 @@ class EmailFetcher:
         
         for attempt in range(max_retries):
             try:
-                context = ssl.create_default_context()
-                context.check_hostname = False
-                context.verify_mode = ssl.CERT_NONE
-
                 logger.info(f"Connecting to {self.config.IMAP_SERVER}:{self.config.IMAP_PORT}...")
-                self.imap_server = imaplib.IMAP4_SSL(
-                    self.config.IMAP_SERVER, 
-                    self.config.IMAP_PORT, 
-                    ssl_context=context
-                )
+                if self.config.IMAP_SSL:
+                    context = ssl.create_default_context()
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                    self.imap_server = imaplib.IMAP4_SSL(
+                        self.config.IMAP_SERVER, 
+                        self.config.IMAP_PORT, 
+                        ssl_context=context
+                    )
+                else:
+                    self.imap_server = imaplib.IMAP4(self.config.IMAP_SERVER, self.config.IMAP_PORT)
                 self.imap_server.login(self.config.EMAIL, self.config.PASSWORD)
+                self.capabilities = self.get_capabilities()
+                if 'QRESYNC' in self.capabilities:
+                    # Les suppressions sont alors signalées par des réponses VANISHED
+                    self.imap_server.xatom('ENABLE', 'QRESYNC')
                 logger.info("Successfully connected to IMAP server")
                 return
                 
@@ -279,42 +830,48 @@ class EmailFetcher:
         ]
         return hashlib.sha256(''.join(hash_content).encode()).hexdigest()
 
+    def parse_message(self, header: bytes, body: bytes) -> Message:
+        """Analyse un message par morceaux sans conserver le contenu des pièces jointes"""
+        parser = BytesFeedParser(_factory=TextOnlyMessage, policy=compat32)
+        # Les en-têtes de la première phase se terminent par une ligne vide
+        parser.feed(header)
+        for i in range(0, len(body), PARSE_CHUNK_SIZE):
+            parser.feed(body[i:i + PARSE_CHUNK_SIZE])
+        return parser.close()
+
+    def decode_part(self, part: Message) -> str:
+        """Décode une partie texte avec le jeu de caractères qu'elle déclare"""
+        payload = part.get_payload(decode=True)
+        if not payload:
+            return ""
+        charset = part.get_content_charset() or 'utf-8'
+        try:
+            return payload.decode(charset, 'replace')
+        except LookupError:
+            return payload.decode('utf-8', 'replace')
+
     def get_email_body(self, msg: Message) -> str:
-        """Extrait le corps du message en texte brut et HTML"""
-        text_content = ""
-        html_content = ""
-        
+        """Extrait le corps du message : toutes les parties texte brut, ou à défaut HTML"""
+        text_parts = []
+        html_parts = []
+
         try:
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_maintype() == 'multipart':
-                        continue
-                    
-                    try:
-                        content_type = part.get_content_type()
-                        body = part.get_payload(decode=True)
-                        
-                        if body:
-                            if content_type == "text/plain":
-                                text_content = body.decode('utf-8', 'ignore')
-                            elif content_type == "text/html":
-                                html_content = body.decode('utf-8', 'ignore')
-                    except Exception as e:
-                        logger.warning(f"Error processing email part: {str(e)}")
-                        continue
-            else:
-                content_type = msg.get_content_type()
+            for part in msg.walk():
+                if part.is_multipart() or part.get_content_disposition() == 'attachment':
+                    continue
+
                 try:
-                    body = msg.get_payload(decode=True)
-                    if body:
-                        if content_type == "text/plain":
-                            text_content = body.decode('utf-8', 'ignore')
-                        elif content_type == "text/html":
-                            html_content = body.decode('utf-8', 'ignore')
+                    content_type = part.get_content_type()
+                    if content_type == "text/plain":
+                        text_parts.append(self.decode_part(part).strip())
+                    elif content_type == "text/html":
+                        html_parts.append(self.decode_part(part).strip())
                 except Exception as e:
-                    logger.warning(f"Error processing single-part email: {str(e)}")
+                    logger.warning(f"Error processing email part: {str(e)}")
+                    continue
 
-            return text_content.strip() if text_content else html_content.strip()
+            body = "\n\n".join(filter(None, text_parts)) or "\n\n".join(filter(None, html_parts))
+            return body[:self.config.MAX_BODY_SIZE]
             
         except Exception as e:
             logger.error(f"Error extracting email body: {str(e)}")
@@ -329,37 +886,398 @@ class EmailFetcher:
             logger.error(f"Error fetching existing emails: {str(e)}")
             return {}
 
-    def sync_mailbox(self, mailbox: str = 'INBOX'):
-        """Synchronise une boîte mail avec la base de données"""
+    def get_sync_state(self, mailbox: str) -> Tuple[Optional[int], int, Optional[int]]:
+        """Récupère le point de reprise (UIDVALIDITY, dernier UID vu, HIGHESTMODSEQ) d'une boîte mail"""
+        self.cursor.execute(
+            "SELECT uidvalidity, last_uid, highestmodseq FROM mailbox_sync_state WHERE mailbox = %s",
+            (mailbox,)
+        )
+        row = self.cursor.fetchone()
+        if row is None:
+            return None, 0, None
+        return row['uidvalidity'], row['last_uid'], row['highestmodseq']
+
+    def save_sync_state(self, mailbox: str, uidvalidity: int, last_uid: int):
+        """Enregistre le point de reprise d'une boîte mail (le commit est fait par l'appelant)"""
+        self.cursor.execute("""
+            INSERT INTO mailbox_sync_state (mailbox, uidvalidity, last_uid, updated_at)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (mailbox)
+            DO UPDATE SET
+                uidvalidity = EXCLUDED.uidvalidity,
+                -- Plusieurs workers peuvent avancer le point de reprise : il ne recule
+                -- que si UIDVALIDITY change
+                last_uid = CASE
+                    WHEN mailbox_sync_state.uidvalidity IS DISTINCT FROM EXCLUDED.uidvalidity
+                        THEN EXCLUDED.last_uid
+                    ELSE GREATEST(mailbox_sync_state.last_uid, EXCLUDED.last_uid)
+                END,
+                updated_at = EXCLUDED.updated_at
+        """, (mailbox, uidvalidity, last_uid, datetime.now()))
+
+    def save_highestmodseq(self, mailbox: str, highestmodseq: Optional[int]):
+        """Enregistre le HIGHESTMODSEQ (RFC 7162) jusqu'auquel les suppressions ont été traitées"""
+        self.cursor.execute(
+            "UPDATE mailbox_sync_state SET highestmodseq = %s WHERE mailbox = %s",
+            (highestmodseq, mailbox)
+        )
+
+    def parse_uid_set(self, uid_set: str) -> List[int]:
+        """Développe un ensemble d'UIDs IMAP (ex: 1,5,7:20) en liste"""
+        uids = []
+        for part in uid_set.split(','):
+            if ':' in part:
+                start, end = sorted(int(bound) for bound in part.split(':'))
+                uids.extend(range(start, end + 1))
+            elif part:
+                uids.append(int(part))
+        return uids
+
+    def find_vanished_uids(self, mailbox: str, last_uid: int, stored_modseq: Optional[int]) -> List[int]:
+        """Détermine les UIDs (<= last_uid) supprimés du serveur depuis la dernière synchronisation
+
+        Avec QRESYNC, seules les modifications depuis stored_modseq sont demandées
+        (VANISHED) ; sinon, les UIDs du serveur sont comparés à ceux enregistrés.
+        """
+        if 'QRESYNC' in self.capabilities and stored_modseq is not None:
+            self.imap_server.response('VANISHED')
+            self.imap_server.uid('fetch', f'1:{last_uid}', f'(UID) (CHANGEDSINCE {stored_modseq} VANISHED)')
+            _, data = self.imap_server.response('VANISHED')
+            vanished = []
+            for line in data or []:
+                if line:
+                    vanished.extend(self.parse_uid_set(line.decode().replace('(EARLIER)', '').strip()))
+            return vanished
+
+        _, messages = self.imap_server.uid('search', None, f'UID 1:{last_uid}')
+        server_uids = {int(uid) for uid in messages[0].split()}
+        self.cursor.execute(
+            "SELECT imap_uid FROM email_locations WHERE mailbox = %s AND imap_uid <= %s",
+            (mailbox, last_uid)
+        )
+        return [row['imap_uid'] for row in self.cursor.fetchall() if row['imap_uid'] not in server_uids]
+
+    def sync_expunged(self, mailbox: str, last_uid: int, stored_modseq: Optional[int],
+                      highestmodseq: Optional[int]):
+        """Répercute en base les messages supprimés ou déplacés depuis la dernière synchronisation"""
+        # HIGHESTMODSEQ inchangé : rien n'a été modifié ni supprimé dans la boîte mail
+        if last_uid == 0 or (highestmodseq is not None and highestmodseq == stored_modseq):
+            return
+
+        vanished = self.find_vanished_uids(mailbox, last_uid, stored_modseq)
+        removed_count = self.remove_locations(mailbox, vanished)
+        self.save_highestmodseq(mailbox, highestmodseq)
+        self.conn.commit()
+        if vanished:
+            logger.info(f"{len(vanished)} messages vanished from {mailbox}, {removed_count} emails removed")
+
+    def get_response_code(self, code: str) -> Optional[int]:
+        """Lit un code de réponse numérique (UIDVALIDITY, UIDNEXT...) renvoyé par le SELECT"""
+        _, data = self.imap_server.response(code)
+        if not data or data[-1] is None:
+            return None
         try:
-            logger.info(f"Synchronizing mailbox: {mailbox}")
-            self.imap_server.select(mailbox)
-            
-            # Récupère tous les UIDs des emails
+            return int(data[-1])
+        except (TypeError, ValueError):
+            return None
+
+    def plan_mailbox(self, mailbox: str) -> Optional[MailboxSyncPlan]:
+        """Sélectionne une boîte mail et détermine les UIDs à synchroniser"""
+        logger.info(f"Synchronizing mailbox: {mailbox}")
+        self.imap_server.select(mailbox)
+        self.selected_mailbox = mailbox
+
+        uidvalidity = self.get_response_code('UIDVALIDITY')
+        uidnext = self.get_response_code('UIDNEXT')
+        highestmodseq = self.get_response_code('HIGHESTMODSEQ')
+        stored_uidvalidity, last_uid, stored_modseq = self.get_sync_state(mailbox)
+        # Termine la transaction de lecture : laissée ouverte, elle garderait un verrou
+        # sur mailbox_sync_state pendant tout le travail des workers
+        self.conn.commit()
+
+        # Resynchronisation complète si UIDVALIDITY est absent ou a changé
+        full_resync = uidvalidity is None or stored_uidvalidity != uidvalidity
+        if full_resync:
+            if stored_uidvalidity is not None:
+                logger.info(f"UIDVALIDITY changed for {mailbox} "
+                            f"({stored_uidvalidity} -> {uidvalidity}), full resync")
+            last_uid = 0
             _, messages = self.imap_server.uid('search', None, 'ALL')
-            all_uids = messages[0].split()
-            
-            logger.info(f"Found {len(all_uids)} emails in mailbox")
-            
-            # Traitement par lots
-            processed_hashes = set()
-            for i in range(0, len(all_uids), self.config.BATCH_SIZE):
-                batch = all_uids[i:i + self.config.BATCH_SIZE]
-                batch_hashes = self.process_email_batch(batch)
-                processed_hashes.update(batch_hashes)
-                
-                # Commit après chaque lot
+            if uidvalidity is not None:
+                self.save_sync_state(mailbox, uidvalidity, 0)
+                self.save_highestmodseq(mailbox, highestmodseq)
                 self.conn.commit()
-                
-            # Nettoyage des anciens emails
-            removed_count = self.cleanup_old_emails(processed_hashes)
-            
-            logger.info(f"Sync complete: {len(processed_hashes)} emails processed, {removed_count} removed")
-            
+        else:
+            self.sync_expunged(mailbox, last_uid, stored_modseq, highestmodseq)
+            if uidnext is not None and uidnext - 1 <= last_uid:
+                logger.info(f"Mailbox {mailbox} is up to date (last UID {last_uid})")
+                return None
+            _, messages = self.imap_server.uid('search', None, f'UID {last_uid + 1}:*')
+
+        # "n:*" renvoie toujours le dernier message, même si son UID est inférieur à n
+        all_uids = sorted(int(uid) for uid in messages[0].split() if int(uid) > last_uid)
+
+        logger.info(f"Found {len(all_uids)} new emails in mailbox {mailbox} (last UID {last_uid})")
+        return MailboxSyncPlan(mailbox, uidvalidity, full_resync, all_uids)
+
+    def sync_uids(self, plan: MailboxSyncPlan, uids: List[int]):
+        """Traite une plage d'UIDs en pipeline : téléchargement, analyse MIME et écriture en parallèle
+
+        La file d'écriture est bornée (PIPELINE_DEPTH) : quand l'analyse ou
+        l'écriture prend du retard, le téléchargement se met en attente.
+        """
+        jobs = queue.Queue(maxsize=self.config.PIPELINE_DEPTH)
+        writer_errors = []
+        writer = threading.Thread(
+            target=self.run_write_stage,
+            args=(plan, jobs, writer_errors),
+            name=f"{threading.current_thread().name}-writer"
+        )
+        writer.start()
+
+        try:
+            for i in range(0, len(uids), self.config.BATCH_SIZE):
+                if writer_errors:
+                    break
+                started = time.perf_counter()
+                job = self.download_batch(uids[i:i + self.config.BATCH_SIZE])
+                job['body_bytes'] = sum(len(body[3]) for body in job['bodies'])
+                job['parsed'] = self.submit_parse(job.pop('bodies'))
+                downloaded = time.perf_counter()
+
+                jobs.put(job)
+                BYTES_DOWNLOADED.labels(plan.mailbox).inc(job['bytes'])
+                self.stats.record('download', len(job['uids']), job['bytes'], downloaded - started,
+                                  time.perf_counter() - downloaded)
+        finally:
+            jobs.put(None)
+            writer.join()
+
+        if writer_errors:
+            raise writer_errors[0]
+
+    def finish_mailbox(self, plan: MailboxSyncPlan):
+        """Termine la synchronisation d'une boîte mail une fois toutes ses plages traitées"""
+        # Nettoyage des anciens emails, uniquement lorsque tous les UIDs ont été parcourus
+        removed_count = 0
+        if plan.full_resync and not plan.failed:
+            removed_count = self.cleanup_old_emails(plan.mailbox, plan.started_at)
+
+        logger.info(f"Sync complete for {plan.mailbox}: {len(plan.processed_hashes)} emails processed, "
+                    f"{removed_count} removed")
+
+    def sync_mailbox(self, mailbox: str = 'INBOX') -> Optional[MailboxSyncPlan]:
+        """Synchronise une boîte mail avec la base de données et retourne son plan (None si à jour)"""
+        try:
+            plan = self.plan_mailbox(mailbox)
+            if plan is None:
+                return None
+            self.sync_uids(plan, plan.uids)
+            self.finish_mailbox(plan)
+            return plan
+
         except Exception as e:
             logger.error(f"Error syncing mailbox {mailbox}: {str(e)}")
+            SYNC_ERRORS.labels(mailbox, 'sync').inc()
             raise
 
+    def sync_chunk(self, plan: MailboxSyncPlan, uids: List[int]):
+        """Traite une plage d'UIDs prise dans la file par un worker"""
+        failed = False
+        try:
+            if self.selected_mailbox != plan.mailbox:
+                self.imap_server.select(plan.mailbox)
+                self.selected_mailbox = plan.mailbox
+            self.sync_uids(plan, uids)
+
+        except Exception as e:
+            failed = True
+            logger.error(f"Error syncing UIDs {uids[0]}:{uids[-1]} of {plan.mailbox}: {str(e)}")
+            SYNC_ERRORS.labels(plan.mailbox, 'sync').inc()
+            # La plage sera reprise au prochain cycle : on repart avec des connexions propres
+            self.conn.rollback()
+            self.selected_mailbox = None
+            self.connect_imap()
+
+        finally:
+            if plan.finish_chunk(failed):
+                self.finish_mailbox(plan)
+
+    def run_sync_worker(self, tasks: queue.Queue):
+        """Worker possédant ses propres connexions IMAP et PostgreSQL"""
+        worker = type(self)(self.config)
+        worker.parse_pool = self.parse_pool
+        worker.stats = self.stats
+        try:
+            worker.connect_imap()
+            worker.connect_db()
+            while True:
+                try:
+                    plan, uids = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                worker.sync_chunk(plan, uids)
+
+        except Exception as e:
+            logger.error(f"Sync worker stopped: {str(e)}")
+
+        finally:
+            worker.cleanup()
+
+    def sync_mailboxes_parallel(self, mailbox_names: List[str]) -> List[Optional[MailboxSyncPlan]]:
+        """Répartit les plages d'UIDs de toutes les boîtes mail entre IMAP_CONCURRENCY workers
+
+        Retourne le plan de chaque boîte mail (None si elle était à jour ou en erreur).
+        """
+        chunks = []
+        plans = []
+        for mailbox_name in mailbox_names:
+            try:
+                plan = self.plan_mailbox(mailbox_name)
+            except Exception as e:
+                logger.error(f"Error syncing mailbox {mailbox_name}: {str(e)}")
+                SYNC_ERRORS.labels(mailbox_name, 'sync').inc()
+                self.conn.rollback()
+                plan = None
+            plans.append(plan)
+            if plan is None:
+                continue
+            if not plan.uids:
+                self.finish_mailbox(plan)
+                continue
+            chunks.extend((plan, uids) for uids in plan.split(self.config.MAILBOX_SPLIT_SIZE))
+
+        # Les plus grosses plages d'abord pour limiter la traîne
+        tasks = queue.Queue()
+        for chunk in sorted(chunks, key=lambda chunk: len(chunk[1]), reverse=True):
+            tasks.put(chunk)
+
+        workers = [
+            threading.Thread(target=self.run_sync_worker, args=(tasks,), name=f"imap-worker-{i}")
+            for i in range(min(self.config.IMAP_CONCURRENCY, len(chunks)))
+        ]
+        logger.info(f"Dispatching {len(chunks)} UID ranges to {len(workers)} workers")
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if not tasks.empty():
+            logger.error(f"{tasks.qsize()} UID ranges left unprocessed, they will be retried next cycle")
+        return plans
+
+    def get_capabilities(self) -> Set[str]:
+        """Retourne les capacités annoncées par le serveur après authentification"""
+        _, data = self.imap_server.capability()
+        return set(data[0].decode().upper().split()) if data and data[0] else set()
+
+    def quote_mailbox(self, mailbox: str) -> str:
+        """Encadre un nom de boîte mail de guillemets pour les commandes IMAP"""
+        return '"' + mailbox.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    def has_buffered_input(self) -> bool:
+        """Indique si des données reçues attendent déjà d'être lues par imaplib
+
+        select() ne voit ni le tampon de lecture d'imaplib (une notification arrivée
+        dans le même segment que la réponse précédente) ni les octets déjà
+        déchiffrés par la couche TLS : on les consulte sans bloquer.
+        """
+        imap = self.imap_server
+        timeout = imap.sock.gettimeout()
+        imap.sock.setblocking(False)
+        try:
+            return bool(imap.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            imap.sock.settimeout(timeout)
+
+    def wait_for_changes_idle(self, timeout: int) -> bool:
+        """Ouvre une session IDLE sur la boîte sélectionnée et attend une notification
+
+        imaplib ne gère pas IDLE avant Python 3.14 : la commande est envoyée à la main.
+        Retourne True si le serveur a signalé un changement (EXISTS, EXPUNGE, FETCH...).
+        """
+        imap = self.imap_server
+        tag = imap._new_tag()
+        imap.send(tag + b' IDLE\r\n')
+        line = imap.readline()
+        if not line.startswith(b'+'):
+            imap.tagged_commands.pop(tag, None)
+            raise imaplib.IMAP4.error(f"IDLE refused: {line.decode(errors='ignore').strip()}")
+
+        changed = False
+        deadline = time.monotonic() + timeout
+        try:
+            while not changed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # select() plutôt qu'un timeout socket, qui rendrait le fichier imaplib inutilisable
+                if not self.has_buffered_input():
+                    readable, _, _ = select.select([imap.sock], [], [], remaining)
+                    if not readable:
+                        break
+                line = imap.readline()
+                if not line or line.startswith(b'* BYE'):
+                    raise imaplib.IMAP4.abort("Connection closed during IDLE")
+                changed = line.startswith(b'*')
+        finally:
+            imap.send(b'DONE\r\n')
+
+        # Les notifications reçues avant la fin de l'IDLE comptent aussi
+        while True:
+            line = imap.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed while ending IDLE")
+            if line.startswith(tag):
+                imap.tagged_commands.pop(tag, None)
+                break
+            changed = changed or line.startswith(b'*')
+        return changed
+
+    def get_mailbox_signature(self, mailbox: str, condstore: bool) -> bytes:
+        """Résumé STATUS d'une boîte mail, qui change à chaque modification"""
+        items = '(UIDNEXT HIGHESTMODSEQ)' if condstore else '(UIDNEXT MESSAGES)'
+        _, data = self.imap_server.status(self.quote_mailbox(mailbox), items)
+        match = STATUS_RE.search(data[0]) if data and data[0] else None
+        return match.group(1) if match else b''
+
+    def wait_for_changes_poll(self, mailbox: str, condstore: bool, timeout: int) -> bool:
+        """Repli sans IDLE : interroge STATUS (HIGHESTMODSEQ si CONDSTORE) à intervalle court"""
+        signature = self.get_mailbox_signature(mailbox, condstore)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.config.PUSH_POLL_INTERVAL)
+            if self.get_mailbox_signature(mailbox, condstore) != signature:
+                return True
+        return False
+
+    def watch_mailbox(self, mailbox: str):
+        """Mode push : ingère les nouveaux messages d'une boîte mail dès leur arrivée"""
+        retry_delay = 10
+        while True:
+            try:
+                self.connect_imap()
+                self.connect_db()
+                use_idle = 'IDLE' in self.capabilities
+                condstore = 'CONDSTORE' in self.capabilities
+                logger.info(f"Watching {mailbox} with {'IDLE' if use_idle else 'STATUS polling'}")
+
+                while True:
+                    # Rattrapage incrémental (UIDs > point de reprise), puis attente
+                    self.sync_mailbox(mailbox)
+                    if use_idle:
+                        self.wait_for_changes_idle(self.config.IDLE_TIMEOUT)
+                    else:
+                        self.wait_for_changes_poll(mailbox, condstore, self.config.IDLE_TIMEOUT)
+
+            except Exception as e:
+                logger.error(f"Push session for {mailbox} failed: {str(e)}")
+                self.cleanup()
+                logger.info(f"Reconnecting in {retry_delay} seconds...")
+                time.sleep(retry_delay)
+
     def parse_mailbox_name(self, mailbox_bytes: bytes) -> str:
         """Parse le nom de la boîte mail depuis la réponse IMAP"""
         try:
@@ -378,28 +1296,59 @@ class EmailFetcher:
         """Synchronise toutes les boîtes mail disponibles"""
         try:
             logger.info("Starting full mailbox synchronization")
+            started_at = datetime.now()
             self.connect_imap()
             self.connect_db()
+
+            if self.config.PARSE_WORKERS > 0:
+                # "spawn" : les processus ne doivent pas hériter des threads et connexions en cours
+                self.parse_pool = ProcessPoolExecutor(
+                    max_workers=self.config.PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
             
             _, mailboxes = self.imap_server.list()
-            
-            for mailbox in mailboxes:
-                mailbox_name = self.parse_mailbox_name(mailbox)
-                try:
-                    self.sync_mailbox(mailbox_name)
-                except Exception as e:
-                    logger.error(f"Error syncing mailbox {mailbox_name}: {str(e)}")
-                    continue
+            mailbox_names = [self.parse_mailbox_name(mailbox) for mailbox in mailboxes
+                             if not NOSELECT_RE.match(mailbox)]
+
+            if self.config.IMAP_CONCURRENCY > 1:
+                plans = self.sync_mailboxes_parallel(mailbox_names)
+            else:
+                plans = []
+                for mailbox_name in mailbox_names:
+                    try:
+                        plans.append(self.sync_mailbox(mailbox_name))
+                    except Exception as e:
+                        logger.error(f"Error syncing mailbox {mailbox_name}: {str(e)}")
+                        self.conn.rollback()
+                        plans.append(None)
+
+            # Emails sans emplacement (antérieurs à email_locations) : supprimés seulement
+            # si toutes les boîtes mail ont été entièrement parcourues pendant ce cycle
+            if plans and all(plan is not None and plan.completed_full_resync() for plan in plans):
+                removed_count = self.cleanup_unlocated_emails(started_at)
+                logger.info(f"{removed_count} emails no longer in any mailbox removed")
                     
         except Exception as e:
             logger.error(f"Error in sync_all_mailboxes: {str(e)}")
             raise
             
         finally:
+            if self.parse_pool is not None:
+                self.parse_pool.shutdown()
+                self.parse_pool = None
+            if self.stats.stages:
+                logger.info(f"Pipeline stats: {self.stats.summary()}")
             self.cleanup()
 
     def cleanup(self):
         """Nettoie les ressources"""
+        if self.lookup_conn:
+            try:
+                self.lookup_conn.close()
+            except Exception as e:
+                logger.error(f"Error closing database connection: {str(e)}")
+
         if self.conn:
             try:
                 self.conn.close()
@@ -415,10 +1364,64 @@ class EmailFetcher:
             except Exception as e:
                 logger.error(f"Error closing IMAP connection: {str(e)}")
 
+def parse_email_rows(config: Config, bodies: List[tuple]) -> Tuple[List[tuple], float, int]:
+    """Étape d'analyse MIME d'un lot, exécutée dans le pool de processus
+
+    Retourne les lignes, la durée de l'analyse et le nombre d'emails en erreur
+    (les métriques du processus parent sont mises à jour par l'étape d'écriture).
+    """
+    started = time.perf_counter()
+    # Aucune connexion n'est ouverte : seules les méthodes d'analyse sont utilisées
+    parser = EmailFetcher(config)
+    rows = {}
+    errors = 0
+    for uid, header, unique_id, body in bodies:
+        try:
+            rows[unique_id] = parser.build_email_row(uid, header, unique_id, body)
+        except Exception as e:
+            errors += 1
+            logger.error(f"Error processing email {uid}: {str(e)}")
+    return list(rows.values()), time.perf_counter() - started, errors
+
+def init_database(config: Config):
+    """Crée le schéma de la base et applique les migrations (au démarrage, processus principal)"""
+    fetcher = EmailFetcher(config)
+    try:
+        fetcher.connect_db()
+        fetcher.init_schema()
+    finally:
+        fetcher.cleanup()
+
+def start_push_watchers(config: Config) -> List[threading.Thread]:
+    """Lance une session push (IDLE) par dossier surveillé"""
+    watchers = []
+    for mailbox in config.PUSH_FOLDERS:
+        watcher = threading.Thread(
+            target=EmailFetcher(config).watch_mailbox,
+            args=(mailbox,),
+            name=f"push-{mailbox}",
+            daemon=True
+        )
+        watcher.start()
+        watchers.append(watcher)
+    return watchers
+
 def main():
     """Fonction principale avec gestion des erreurs et retries"""
     max_retries = 3
     retry_delay = 10  # secondes entre les retries en cas d'erreur
+
+    config = Config()
+    if config.METRICS_PORT:
+        # Exporteur Prometheus, partagé par les cycles et les sessions push
+        start_http_server(config.METRICS_PORT)
+        logger.info(f"Metrics exported on port {config.METRICS_PORT}")
+    init_database(config)
+    if config.SYNC_MODE == 'push':
+        # Les dossiers surveillés sont ingérés en continu ; le cycle complet
+        # ci-dessous couvre les autres dossiers et les suppressions
+        config.validate()
+        start_push_watchers(config)
     
     while True:
         for attempt in range(max_retries):
@@ -442,7 +1445,7 @@ def main():
                     logger.error("Max retries reached, waiting for next cycle")
         
         # Attend l'intervalle configuré avant le prochain cycle
-        sleep_time = fetcher.config.FETCH_INTERVAL
+        sleep_time = config.FETCH_INTERVAL
         logger.info(f"Waiting {sleep_time} seconds until next cycle...")
         time.sleep(sleep_time)
 
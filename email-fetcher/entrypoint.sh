@@ -1,9 +1,11 @@
 #!/bin/bash
 # entrypoint.sh
 
+# email_fetcher.py gère lui-même l'intervalle entre les cycles (FETCH_INTERVAL)
+# et le mode push (SYNC_MODE=push) : on ne fait que le relancer s'il s'arrête.
 while true; do
     echo "Starting email fetch..."
     python /app/email_fetcher.py
-    echo "Sleeping for ${FETCH_INTERVAL:-3600} seconds..."
-    sleep ${FETCH_INTERVAL:-3600}
+    echo "Fetcher exited, restarting in 10 seconds..."
+    sleep 10
 done
\ No newline at end of file